@@ -1,26 +1,31 @@
 import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
 import cloudinary.uploader
 import os
 from datetime import datetime
 import config
 import logging
-import re
-import csv
-
-def read_script_list(file_path):
-    """Read SCRIPT_LIST_PATH into a dictionary of scriptId to flags."""
-    if not os.path.exists(file_path):
-        logging.warning(f"SCRIPT_LIST_PATH '{file_path}' does not exist, assuming all flags are False")
-        return {}
-    with open(file_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        return {row['scriptId']: {
-            'coverImageUploaded': row.get('coverImageUploaded', 'False') == 'True',
-            'imageContentUploaded': row.get('imageContentUploaded', 'False') == 'True'
-        } for row in reader}
-
-def upload_to_cloudinary(folder_path, account_type):
-    """Upload images from a folder to the specified Cloudinary account, respecting upload flags."""
+import json
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import data_update
+import http_client
+import upload_queue
+
+# Cloudinary folder each account's images are uploaded to
+ACCOUNT_FOLDERS = {
+    "cover": "your_cloudinary_folder_name",  # Consider making this configurable via config.py
+    "content": "larp_script_image_content",
+}
+# SCRIPT_LIST_PATH flag recording that an account holds all of a script's images
+ACCOUNT_FLAG_KEYS = {"cover": 'coverImageUploaded', "content": 'imageContentUploaded'}
+# Detail-row field holding each account's '@'-joined source URLs
+ACCOUNT_URL_FIELDS = {"cover": 'scriptCoverUrl', "content": 'scriptImageContent'}
+
+def get_account_config(account_type):
+    """Return (cloud_config, folder, flag_key) for the 'cover' or 'content' Cloudinary account."""
     # Log initial configuration attempt
     logging.debug(f"Configuring Cloudinary for account_type={account_type}")
 
@@ -32,8 +37,8 @@ def upload_to_cloudinary(folder_path, account_type):
             "api_secret": config.CLOUDINARY_COVER_API_SECRET,
             "secure": True
         }
-        folder = "your_cloudinary_folder_name"  # Consider making this configurable via config.py
-        flag_key = 'coverImageUploaded'
+        folder = ACCOUNT_FOLDERS["cover"]
+        flag_key = ACCOUNT_FLAG_KEYS["cover"]
     elif account_type == "content":
         cloud_config = {
             "cloud_name": config.CLOUDINARY_CONTENT_CLOUD_NAME,
@@ -41,8 +46,8 @@ def upload_to_cloudinary(folder_path, account_type):
             "api_secret": config.CLOUDINARY_CONTENT_API_SECRET,
             "secure": True
         }
-        folder = "larp_script_image_content"
-        flag_key = 'imageContentUploaded'
+        folder = ACCOUNT_FOLDERS["content"]
+        flag_key = ACCOUNT_FLAG_KEYS["content"]
     else:
         raise ValueError("Invalid account_type. Use 'cover' or 'content'.")
 
@@ -51,84 +56,219 @@ def upload_to_cloudinary(folder_path, account_type):
         if not value:
             logging.error(f"Cloudinary {key} for {account_type} is not set. Current value: {value}")
             raise ValueError(f"Cloudinary {key} for {account_type} is missing or empty")
+    return cloud_config, folder, flag_key
 
-    # Apply configuration and log it
-    cloudinary.config(**cloud_config)
-    logging.debug(f"Cloudinary configured: cloud_name={cloud_config['cloud_name']}, api_key={cloud_config['api_key'][:5]}****, secure={cloud_config['secure']}")
+# Errors that retrying cannot fix; everything else (rate limits, 5xx, network) is retried
+NON_RETRYABLE_ERRORS = (
+    cloudinary.exceptions.BadRequest,
+    cloudinary.exceptions.AuthorizationRequired,
+    cloudinary.exceptions.NotAllowed,
+    cloudinary.exceptions.NotFound,
+    cloudinary.exceptions.AlreadyExists,
+)
 
-    # Check if the folder exists
-    if not os.path.exists(folder_path):
-        raise FileNotFoundError(f"Folder '{folder_path}' does not exist.")
+def upload_file(source, public_id, folder, cloud_config):
+    """Upload one file or URL with per-call account credentials, retrying transient errors."""
+    for attempt in range(config.CLOUDINARY_UPLOAD_RETRIES):
+        try:
+            return cloudinary.uploader.upload(
+                source,
+                public_id=public_id,
+                folder=folder,
+                use_filename=False,
+                unique_filename=False,
+                overwrite=False,
+                **cloud_config
+            )
+        except NON_RETRYABLE_ERRORS:
+            raise
+        except Exception as e:
+            if attempt == config.CLOUDINARY_UPLOAD_RETRIES - 1:
+                raise
+            delay = http_client.backoff_delay(attempt)
+            logging.warning(f"Upload attempt {attempt+1} for {public_id} failed ({str(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
 
-    # Read SCRIPT_LIST_PATH to check upload status
-    script_list_status = read_script_list(config.SCRIPT_LIST_PATH)
-    logging.debug(f"Loaded {len(script_list_status)} scripts from SCRIPT_LIST_PATH for {account_type} upload check")
+def upload_group(group, folder, cloud_config):
+    """Upload entries sharing a sha256, the first from disk and the rest from its Cloudinary URL."""
+    results = []
+    uploaded_url = None
+    for entry in group:
+        source = uploaded_url or entry['path']
+        try:
+            response = upload_file(source, entry['publicId'], folder, cloud_config)
+            uploaded_url = uploaded_url or response['secure_url']
+            results.append((entry, response['secure_url'], None))
+        except Exception as e:
+            results.append((entry, None, e))
+    return results
 
-    # Supported image extensions
-    image_extensions = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
-    all_files = [f for f in os.listdir(folder_path) if f.lower().endswith(image_extensions)]
-    total_files = len(all_files)
-    uploaded_count = 0
-    error_count = 0
+def upload_groups(groups, folder, cloud_config, uploaded_status, total_files, error_count=0):
+    """Upload entry groups on the thread pool; returns (publicIds uploaded, error_count)."""
+    completed = []
+    with ThreadPoolExecutor(max_workers=config.CLOUDINARY_UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(upload_group, group, folder, cloud_config) for group in groups]
+        for future in as_completed(futures):
+            for entry, secure_url, error in future.result():
+                if error is None:
+                    completed.append(entry['publicId'])
+                    logging.info(f"[{len(completed) + error_count}/{total_files}] Uploaded {entry['path']}: {secure_url}")
+                else:
+                    uploaded_status[entry['scriptId']] = False
+                    error_count += 1
+                    logging.error(f"[{len(completed) + error_count}/{total_files}] ERROR uploading {entry['path']}: {str(error)}")
+    return completed, error_count
+
+def upload_entries(entries, account_type):
+    """Upload entries without touching the queue; returns (publicIds uploaded, {scriptId: all uploaded})."""
+    cloud_config, folder, _ = get_account_config(account_type)
+    logging.debug(f"Cloudinary account {account_type}: cloud_name={cloud_config['cloud_name']}, api_key={cloud_config['api_key'][:5]}****, secure={cloud_config['secure']}")
 
+    error_count = 0
     uploaded_status = {}  # Track upload status per scriptId
-    
-    # Regex patterns to extract scriptId from filename
-    cover_pattern = re.compile(r"^(.*?)_(\d+)_(.*?)_\d+_cover_(.*)\.(\w+)$")
-    content_pattern = re.compile(r"^(.*?)_(\d+)_(.*?)_\d+_image_content_(.*)\.(\w+)$")
-
-    for index, filename in enumerate(all_files, 1):
-        file_path = os.path.join(folder_path, filename)
-        script_id = None
-        public_id = None
-
-        # Extract scriptId based on account_type
-        if account_type == "cover":
-            match = cover_pattern.match(filename)
-            if match:
-                script_id = match.group(2)
-                public_id = f"{script_id}"
-            else:
-                logging.warning(f"[{index}/{total_files}] Filename {filename} does not match cover pattern, skipping")
-                continue
-        elif account_type == "content":
-            match = content_pattern.match(filename)
-            if match:
-                script_id = match.group(2)
-                file_name = match.group(4)
-                public_id = f"{script_id}_{file_name}"
-            else:
-                logging.warning(f"[{index}/{total_files}] Filename {filename} does not match content pattern, skipping")
-                continue
+    # Identical bytes are sent once; the other copies are re-ingested from Cloudinary
+    groups = {}
 
-        # Check if upload is needed based on SCRIPT_LIST_PATH
-        if script_id in script_list_status and script_list_status[script_id][flag_key]:
-            logging.debug(f"[{index}/{total_files}] Skipping {filename} for scriptId={script_id} as {flag_key} is already True")
-            uploaded_status[script_id] = True
+    for entry in entries:
+        uploaded_status.setdefault(entry['scriptId'], True)
+        if not os.path.exists(entry['path']):
+            logging.warning(f"Queued file {entry['path']} for scriptId={entry['scriptId']} no longer exists, skipping")
+            uploaded_status[entry['scriptId']] = False
+            error_count += 1
             continue
+        groups.setdefault(entry.get('sha256') or entry['path'], []).append(entry)
+
+    completed, error_count = upload_groups(groups.values(), folder, cloud_config, uploaded_status, len(entries), error_count)
+    logging.info(f"Upload Summary ({account_type}): {len(completed)} uploaded, {error_count} errors")
+    return completed, uploaded_status
 
-        if script_id not in uploaded_status:
+def upload_pending(account_type):
+    """Upload the account's queued images; returns (uploaded_count, {scriptId: all uploaded})."""
+    completed, uploaded_status = upload_entries(list(upload_queue.load_pending(account_type).values()), account_type)
+    upload_queue.complete(account_type, completed)
+    return len(completed), uploaded_status
+
+def ingest_remote(scripts, account_type):
+    """Have Cloudinary fetch the scripts' original image URLs itself; returns the same as upload_pending."""
+    cloud_config, folder, flag_key = get_account_config(account_type)
+    url_field = ACCOUNT_URL_FIELDS[account_type]
+    uploaded_status = {}  # Track upload status per scriptId
+    groups = {}  # source url -> entries, with the URL standing in for the local path
+
+    for script in scripts:
+        script_id = script['scriptId']
+        if str(script.get(flag_key, 'False')) == 'True':
+            continue
+        urls = [url for url in script.get(url_field, '').split('@') if url]
+        if urls:
             uploaded_status[script_id] = True
+        for url in urls:
+            groups.setdefault(url, []).append(upload_queue.build_entry(account_type, script_id, url, url, ''))
 
-        # Log before upload attempt to confirm configuration
-        current_config = cloudinary.config()
-        logging.debug(f"Before upload [{index}/{total_files}] of {filename}: cloud_name={current_config.cloud_name}, api_key={current_config.api_key[:5] if current_config.api_key else 'None'}****")
+    total_files = sum(len(group) for group in groups.values())
+    logging.info(f"Remote ingest ({account_type}): {total_files} images from {len(groups)} source URLs")
+    completed, error_count = upload_groups(groups.values(), folder, cloud_config, uploaded_status, total_files)
+    logging.info(f"Remote Ingest Summary ({account_type}): {len(completed)} ingested, {error_count} errors")
+    return len(completed), uploaded_status
 
-        try:
-            response = cloudinary.uploader.upload(
-                file_path,
-                public_id=public_id,
-                folder=folder,
-                use_filename=False,
-                unique_filename=False,
-                overwrite=False
-            )
-            uploaded_count += 1
-            logging.info(f"[{index}/{total_files}] Uploaded {filename}: {response['secure_url']}")
-        except Exception as e:
-            uploaded_status[script_id] = False
-            error_count += 1
-            logging.error(f"[{index}/{total_files}] ERROR uploading {filename}: {str(e)}")
+def cloudinary_listing(account_type):
+    """Page function over an account's uploaded resources in its folder (Admin API)."""
+    cloud_config, folder, _ = get_account_config(account_type)
+    def list_page(next_cursor=None):
+        kwargs = {'next_cursor': next_cursor} if next_cursor else {}
+        return cloudinary.api.resources(
+            type='upload',
+            prefix=f"{folder}/",
+            max_results=config.CLOUDINARY_LIST_PAGE_SIZE,
+            **kwargs,
+            **cloud_config
+        )
+    return list_page
+
+class LocalListing:
+    """Stand-in for cloudinary.api.resources that serves public_ids from a JSON file."""
+
+    def __init__(self, resources, page_size=None):
+        self.resources = resources
+        self.page_size = page_size or config.CLOUDINARY_LIST_PAGE_SIZE
+
+    @classmethod
+    def from_file(cls, path, page_size=None):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), page_size)
+
+    def __call__(self, account_type):
+        public_ids = self.resources.get(account_type, [])
+        def list_page(next_cursor=None):
+            start = int(next_cursor or 0)
+            end = start + self.page_size
+            page = {'resources': [{'public_id': public_id} for public_id in public_ids[start:end]]}
+            if end < len(public_ids):
+                page['next_cursor'] = str(end)
+            return page
+        return list_page
+
+def list_remote_public_ids(account_type, listing=cloudinary_listing):
+    """Every public_id in the account's folder, without the folder prefix, paging until exhausted."""
+    list_page = listing(account_type)
+    prefix = f"{ACCOUNT_FOLDERS[account_type]}/"
+    public_ids = set()
+    next_cursor = None
+    pages = 0
+    while True:
+        page = list_page(next_cursor)
+        pages += 1
+        for resource in page.get('resources', []):
+            public_id = resource['public_id']
+            public_ids.add(public_id[len(prefix):] if public_id.startswith(prefix) else public_id)
+        next_cursor = page.get('next_cursor')
+        if not next_cursor:
+            break
+    logging.info(f"Listed {len(public_ids)} {account_type} resources in {pages} pages")
+    return public_ids
+
+def reconcile_upload_flags(listing=cloudinary_listing, dry_run=False):
+    """Rewrite upload flags from the accounts' actual resources; returns the number of scripts changed."""
+    details = data_update.read_details(columns=ACCOUNT_URL_FIELDS.values())
+    flags = {}
+    for account_type in ("cover", "content"):
+        flag_key = ACCOUNT_FLAG_KEYS[account_type]
+        remote_ids = list_remote_public_ids(account_type, listing)
+        url_field = ACCOUNT_URL_FIELDS[account_type]
+        missing_count = 0
+        for detail in details:
+            urls = [url for url in detail.get(url_field, '').split('@') if url]
+            if not urls:
+                continue
+            uploaded = all(upload_queue.public_id_for(account_type, detail['scriptId'], url) in remote_ids for url in urls)
+            missing_count += not uploaded
+            flags.setdefault(detail['scriptId'], {})[flag_key] = uploaded
+        logging.info(f"Reconciliation ({account_type}): {missing_count} scripts missing at least one image")
+        if not dry_run:
+            upload_queue.complete(account_type, [
+                public_id for public_id in upload_queue.load_pending(account_type) if public_id in remote_ids
+            ])
+
+    if dry_run:
+        current = {row['scriptId']: row for row in data_update.read_script_list()}
+        changed_count = sum(
+            1 for script_id, script_flags in flags.items() if script_id in current and
+            any(current[script_id].get(field) != str(value) for field, value in script_flags.items())
+        )
+        logging.info(f"Dry run: {changed_count} scripts would have their upload flags changed")
+        return changed_count
+    return data_update.set_script_list_flags(flags)
+
+if __name__ == "__main__":
+    from logging_config import setup_logger
+
+    parser = argparse.ArgumentParser(description="Reconcile upload flags with the Cloudinary accounts' resources.")
+    parser.add_argument('--dry-run', action='store_true', help="report changes without writing them")
+    parser.add_argument('--listing-file', help="JSON file of public_ids per account to use instead of the Cloudinary API")
+    args = parser.parse_args()
 
-    logging.info(f"Upload Summary: {uploaded_count} uploaded, {error_count} errors")
-    return uploaded_count, uploaded_status
\ No newline at end of file
+    setup_logger(log_folder=config.LOG_FOLDER)
+    listing = LocalListing.from_file(args.listing_file) if args.listing_file else cloudinary_listing
+    reconcile_upload_flags(listing, dry_run=args.dry_run)
+    if not args.dry_run:
+        data_update.export_script_list()
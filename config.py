@@ -14,6 +14,18 @@ CLOUDINARY_CONTENT_CLOUD_NAME = os.getenv("CLOUDINARY_CONTENT_CLOUD_NAME")
 CLOUDINARY_CONTENT_API_KEY = os.getenv("CLOUDINARY_CONTENT_API_KEY")
 CLOUDINARY_CONTENT_API_SECRET = os.getenv("CLOUDINARY_CONTENT_API_SECRET")
 
+# Cloudinary Uploads
+CLOUDINARY_UPLOAD_WORKERS = 8  # concurrent uploads per account
+CLOUDINARY_UPLOAD_RETRIES = 5
+# Let Cloudinary fetch images from their source URLs instead of downloading and re-uploading them
+CLOUDINARY_REMOTE_INGEST = False
+CLOUDINARY_LIST_PAGE_SIZE = 500  # Admin API maximum per resources call
+# Pending-upload queues (JSON Lines) written by the downloader and consumed by the uploader
+PENDING_UPLOAD_PATHS = {
+    "cover": "data/pending_uploads/cover.jsonl",
+    "content": "data/pending_uploads/content.jsonl",
+}
+
 # API Endpoints
 HOST = "https://api.h5.helloaba.cn/"
 SCRIPT_SEARCH_PAGE = "script/v9/scriptSearchPage"
@@ -22,19 +34,122 @@ PLAT_FORM_SCRIPT_INFO = "script/v2/platformScriptInfo"
 # Request Configuration
 REQUEST_TIMEOUT = 60
 TIMEOUT_RETRY_LIMIT = 8
+DETAIL_FETCH_CONCURRENCY = 32
+
+# Streaming Pipeline (main(pipeline_mode=True))
+PIPELINE_QUEUE_SIZE = 32  # scripts buffered between two stages
+PIPELINE_QUEUE_FLUSH_INTERVAL = 60  # seconds between rewrites of the pending-upload queues during a run
+PIPELINE_STAGE_WORKERS = {
+    "detail": DETAIL_FETCH_CONCURRENCY,
+    "download": 8,
+    "upload": 4,
+    "translate": 2,
+    "upsert": 16,
+}
+
+# Detail Refresh Scheduler (incremental mode)
+DETAIL_REFRESH_BUDGET = 200  # existing scripts re-fetched per run
+DETAIL_REFRESH_MIN_AGE = 6 * 60 * 60  # seconds; fresher details are never refreshed
+DETAIL_REFRESH_WEIGHTS = {  # popularity multipliers applied to log1p of each detail field
+    "scriptPlayedCount": 1.0,
+    "scriptWantPlayerCount": 1.0,
+    "scriptScore": 0.5,
+}
+
+# Shared HTTP Client
+HTTP_CONNECTION_LIMIT = 128
+HTTP_HOST_LIMITS = {
+    "api.h5.helloaba.cn": 64,  # API host
+    "file.static.helloaba.cn": 32,  # OSS image host
+}
+HTTP_DNS_CACHE_TTL = 300  # seconds
+HTTP_KEEPALIVE_TIMEOUT = 30  # seconds
+HTTP_HOST_RATE_LIMITS = {  # requests per second
+    "api.h5.helloaba.cn": 30,
+    "file.static.helloaba.cn": 60,
+}
+
+# Retry Policy (shared by every request of a run)
+RETRY_BACKOFF_BASE = 1  # seconds
+RETRY_BACKOFF_CAP = 30  # seconds
+RETRY_BUDGET_RATIO = 0.2  # retries earned per request sent
+RETRY_BUDGET_MIN = 50  # retries always available per run
+CIRCUIT_FAILURE_THRESHOLD = 10  # consecutive failures that open a host's circuit
+CIRCUIT_RESET_TIMEOUT = 15  # seconds before an open circuit lets a probe through
+
+# Script List Crawl Concurrency (AIMD)
+LIST_INITIAL_CONCURRENCY = 8
+LIST_MIN_CONCURRENCY = 2
+LIST_MAX_CONCURRENCY = 64
+LIST_TARGET_LATENCY = 5  # seconds; slower pages shrink the in-flight limit
+LIST_MAX_ERROR_RATE = 0.1
+LIST_MAX_PAGE = 5000  # the last-page probe never looks past this pageNum
+LIST_PROBE_RETRIES = 3  # attempts per probed page before the full crawl is abandoned
+
+# Delta Script List Crawl
+DELTA_LIST_KNOWN_PAGE_LIMIT = 3  # stop after this many consecutive pages of known scriptIds
+DELTA_LIST_MAX_FAILED_PAGES = 3  # consecutive failed pages that abandon the delta crawl
+DELTA_LIST_PAYLOAD_OVERRIDES = {}  # scriptSearchPage fields selecting the newest-first ordering; empty disables the delta crawl
+FULL_LIST_CRAWL_INTERVAL = 24 * 60 * 60  # seconds between full reconciliation crawls
 
 # File Paths
-SCRIPT_LIST_PATH = "data/script_data_simple.csv"
+SCRIPT_LIST_PATH = "data/script_data_simple.csv"  # exported from STATE_DB_PATH for compatibility
+STATE_DB_PATH = "data/state.sqlite3"  # script list and pipeline flags
 DETAILED_CSV_PATH = "data/script_data_detailed.csv"
+DETAILED_PARQUET_PATH = "data/script_data_detailed.parquet"
+DETAIL_JOURNAL_PATH = "data/journal/script_details.jsonl"
 TRANSLATED_CSV_PATH = "data/translated/script_data_detailed.csv"
+TRANSLATED_PARQUET_PATH = "data/translated/script_data_detailed.parquet"
 SCRIPT_COVER_FOLDER = "data/downloaded/script_cover"
 SCRIPT_IMAGE_CONTENT_FOLDER = "data/downloaded/script_image_content"
+IMAGE_STORE_FOLDER = "data/downloaded/store"  # content-addressed by SHA-256
+IMAGE_MANIFEST_PATH = "data/downloaded/image_manifest.json"
+IMAGE_DERIVATIVE_FOLDER = "data/downloaded/derivatives"
 LOG_FOLDER = "log"
 INCREMENTAL_OUTPUT_FOLDER_PATH = "data/incremental"
+LIST_CRAWL_STATE_PATH = "data/list_crawl_state.json"
+
+# Detail Store (Parquet with pyarrow installed, the CSV files otherwise)
+DETAIL_STORE_FORMAT = "parquet"  # "csv" keeps DETAILED_CSV_PATH / TRANSLATED_CSV_PATH as the primary files
+DETAIL_ROW_GROUP_SIZE = 2048  # rows per Parquet row group, the unit a scriptId filter can skip
+DETAIL_MERGE_BATCH_SIZE = 2000  # details merged into the dataset per rewrite
+EXPORT_DETAIL_CSV = True  # write the CSV files from the Parquet store at the end of each run
+
+# Translation (Step 5)
+TRANSLATE_FIELDS = ('scriptName', 'scriptTextContent', 'scriptTag', 'scriptDifficultyDegreeName', 'scriptIssueInfoItems')  # other columns are copied unconverted
+TRANSLATION_CACHE_PATH = "data/translated/translation_cache.json"
+TRANSLATION_CACHE_CHARS = 5_000_000  # characters of cached source and converted text, least recently used evicted first
+TRANSLATION_CACHE_MAX_TEXT = 200  # longer strings, such as script descriptions, are converted without caching
+TRANSLATION_WORKERS = None  # processes converting large batches; None uses os.cpu_count()
+TRANSLATION_CHUNK_SIZE = 2000  # distinct strings per worker task; fewer misses are converted inline
+TRANSLATION_BATCH_ROWS = 5000  # rows read, translated and written per step of a full rebuild
+
+# Database Import (Step 6)
+RELATION_IMPORT_CHUNK_SIZE = 1000  # values per lookup or bulk insert of the author/issuer relation import
+
+# Image Download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes streamed per read
 
 # Compression Threshold
 COMPRESSION_THRESHOLD = 5 * 1024 * 1024  # 5 MB
 
+# Target-Size Image Encoder
+IMAGE_BYTE_BUDGET = COMPRESSION_THRESHOLD  # larger images are re-encoded to fit within it
+IMAGE_MAX_LOSSLESS_BYTES_PER_PIXEL = 1.0  # PNG/BMP above this are re-encoded even within budget
+IMAGE_ENCODE_FORMAT = "WEBP"  # used for sources that are neither WebP nor JPEG
+IMAGE_MIN_QUALITY = 40
+IMAGE_MAX_QUALITY = 90
+IMAGE_DOWNSCALE_STEPS = (1.0, 0.85, 0.7, 0.55, 0.4)
+
+# Image Processing Pool
+IMAGE_PROCESSING_WORKERS = None  # None uses every available core
+IMAGE_PROCESSING_QUEUE_SIZE = None  # None allows two queued images per worker
+
+# Responsive Image Derivatives (empty IMAGE_DERIVATIVE_WIDTHS disables them)
+IMAGE_DERIVATIVE_WIDTHS = (256, 512, 1024)  # px; sources are never upscaled
+IMAGE_DERIVATIVE_FORMATS = {"WEBP": ".webp", "JPEG": ".jpg"}
+IMAGE_DERIVATIVE_QUALITY = 80
+
 # Other Constants
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
 
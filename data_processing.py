@@ -1,20 +1,188 @@
-import pandas as pd
 import zhconv
 import csv
+import hashlib
+import json
 import os
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import config
+import data_update
 
 def translate_csv(input_csv, output_csv):
-    if not os.path.exists(input_csv):
-        logging.error(f"Input file {input_csv} not found.")
-        return
+    """Rebuild output_csv as the translation of input_csv; kept for callers of the old pandas version."""
+    translate_details(input_csv, output_csv, rebuild=True)
+
+class TranslationCache:
+    """LRU memo of short zhconv conversions, saved to TRANSLATION_CACHE_PATH between runs."""
+
+    def __init__(self, path=None, max_chars=None, max_text=None):
+        self.path = path or config.TRANSLATION_CACHE_PATH
+        self.max_chars = max_chars or config.TRANSLATION_CACHE_CHARS
+        self.max_text = max_text or config.TRANSLATION_CACHE_MAX_TEXT
+        self.entries = OrderedDict()
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        for text, converted in data_update.read_json(self.path, default={}).items():
+            self.put(text, converted)
+
+    def get(self, text):
+        """The cached conversion of text, or None."""
+        converted = self.entries.get(text)
+        if converted is None:
+            self.misses += 1
+        else:
+            self.entries.move_to_end(text)
+            self.hits += 1
+        return converted
+
+    def put(self, text, converted):
+        # Long texts rarely repeat, so caching them would only evict the short ones that do
+        if len(text) > self.max_text or text in self.entries:
+            return
+        self.entries[text] = converted
+        self.chars += len(text) + len(converted)
+        while self.chars > self.max_chars:
+            evicted, evicted_converted = self.entries.popitem(last=False)
+            self.chars -= len(evicted) + len(evicted_converted)
+
+    def save(self):
+        data_update.write_json(self.path, self.entries)
+
+def _convert_chunk(values):
+    """Convert a chunk of distinct strings; runs in a worker process for large batches."""
+    return [zhconv.convert(value, 'zh-hant') for value in values]
+
+class TranslationEngine:
+    """Translate batches of detail rows by distinct value, on a process pool for large batches."""
+
+    def __init__(self, cache=None, workers=None):
+        self.cache = cache or TranslationCache()
+        self.workers = workers or config.TRANSLATION_WORKERS or os.cpu_count() or 1
+        self.executor = None
+        self.started_at = None
+        self.stats = {'rows': 0, 'distinct': 0, 'chunks': 0}
+
+    def __enter__(self):
+        self.started_at = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.cache.save()
+        self.log_stats()
+
+    def convert(self, values):
+        """Map each of a set of distinct strings to its Traditional Chinese form."""
+        converted = {}
+        misses = []
+        for value in values:
+            cached = self.cache.get(value)
+            if cached is None:
+                misses.append(value)
+            else:
+                converted[value] = cached
+        chunk_size = config.TRANSLATION_CHUNK_SIZE
+        if len(misses) > chunk_size and self.workers > 1:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            chunks = [misses[i:i + chunk_size] for i in range(0, len(misses), chunk_size)]
+            results = [result for chunk in self.executor.map(_convert_chunk, chunks) for result in chunk]
+            self.stats['chunks'] += len(chunks)
+        else:
+            results = _convert_chunk(misses)
+        for value, result in zip(misses, results):
+            converted[value] = result
+            self.cache.put(value, result)
+        return converted
+
+    def translate_rows(self, rows):
+        """Translated copies of rows: TRANSLATE_FIELDS converted, other columns as they are."""
+        columns = {field: [row.get(field) for row in rows] for field in config.TRANSLATE_FIELDS}
+        distinct = set()
+        for values in columns.values():
+            distinct.update(value for value in set(values) if isinstance(value, str) and value)
+        converted = self.convert(distinct)
+        translated = [dict(row) for row in rows]
+        for field, values in columns.items():
+            for row, value in zip(translated, values):
+                if value in converted:
+                    row[field] = converted[value]
+        self.stats['rows'] += len(rows)
+        self.stats['distinct'] += len(distinct)
+        return translated
+
+    def log_stats(self):
+        elapsed = time.monotonic() - self.started_at
+        logging.info(f"Translation: {self.stats['rows']} rows, {self.stats['distinct']} distinct strings "
+                     f"({self.cache.hits} cached, {self.cache.misses} converted, {self.stats['chunks']} chunks "
+                     f"on {self.workers} processes) in {elapsed:.1f}s")
+
+def source_digest(row):
+    """Digest of the columns a translation depends on: scriptId and TRANSLATE_FIELDS."""
+    content = {key: row.get(key, '') for key in ('scriptId', *config.TRANSLATE_FIELDS)}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def translate_row(row):
+    """Translate a single row's TRANSLATE_FIELDS to Traditional Chinese; other columns are copied as they are."""
+    return {
+        key: zhconv.convert(value, 'zh-hant') if key in config.TRANSLATE_FIELDS and isinstance(value, str) and value else value
+        for key, value in row.items()
+    }
+
+def translate_details(input_path, output_path, rebuild=False):
+    """Translate new or changed detail rows into output_path; returns the number of rows translated."""
+    translated_digests = {} if rebuild else {
+        row['scriptId']: row.get('sourceDigest', '') for row in data_update.read_details(output_path, columns=('sourceDigest',))
+    }
+    if not any(translated_digests.values()):
+        return rebuild_translation(input_path, output_path)
+
+    source = data_update.read_details(input_path)
+    changed = []
+    digests = {}
+    updates = {}
+    for row in source:
+        digests[row['scriptId']] = source_digest(row)
+        if translated_digests.get(row['scriptId']) != digests[row['scriptId']]:
+            changed.append(row)
+        else:
+            # Columns that are not translated, such as flags and image hashes, are copied over as they are
+            updates[row['scriptId']] = {key: value for key, value in row.items() if key not in config.TRANSLATE_FIELDS}
+    removed = set(translated_digests) - set(digests)
+
+    if changed:
+        with TranslationEngine() as engine:
+            updates.update({row['scriptId']: {**row, 'sourceDigest': digests[row['scriptId']]} for row in engine.translate_rows(changed)})
+    # An empty update drops the translation of a script that left the input
+    updates.update({script_id: {} for script_id in removed})
+    if updates:
+        data_update.merge_details(
+            output_path, updates, lambda existing_row, row: {**(existing_row or {}), **row} if row else None,
+            extra_fields=('sourceDigest',)
+        )
+    logging.info(f"Translated {len(changed)} new or changed rows of {len(source)} into {output_path} ({len(removed)} removed)")
+    return len(changed)
+
+def rebuild_translation(input_path, output_path):
+    """Translate a whole detail dataset into output_path one batch at a time; returns the rows written."""
+    fieldnames = data_update.read_detail_fieldnames(input_path)
+    if not fieldnames:
+        logging.error(f"No detail rows to translate in {input_path}.")
+        return 0
+    fieldnames = [name for name in fieldnames if name != 'sourceDigest'] + ['sourceDigest']
+    with TranslationEngine() as engine:
+        batches = (
+            [{**translated, 'sourceDigest': source_digest(row)} for row, translated in zip(rows, engine.translate_rows(rows))]
+            for rows in data_update.iter_detail_batches(input_path, config.TRANSLATION_BATCH_ROWS)
+        )
+        written = data_update.write_detail_batches(output_path, fieldnames, batches)
+    logging.info(f"Rebuilt {output_path}: translated all {written} rows of {input_path}")
+    return written
 
-    df = pd.read_csv(input_csv, quoting=csv.QUOTE_ALL)
-    df_translated = df.apply(lambda col: col.map(lambda x: zhconv.convert(str(x), 'zh-hant') if isinstance(x, str) else x))
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-    df_translated.to_csv(output_csv, index=False, quoting=csv.QUOTE_ALL)
-    logging.info(f"Translated {input_csv} to {output_csv}")
-    
 def sort_csv_by_script_id(csv_path):
     """Sort CSV by scriptId in ascending order."""
     if not os.path.exists(csv_path):
@@ -1,7 +1,12 @@
 import csv
+import heapq
+import json
+import math
 import os
 import config
+import detail_store
 import logging
+import state_store
 import time
 
 def read_csv(file_path):
@@ -12,6 +17,86 @@ def read_csv(file_path):
         reader = csv.DictReader(f)
         return list(reader)
 
+def iter_csv(file_path):
+    """Yield CSV rows one at a time, so callers can keep only the rows they need."""
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+def stored_row(detail):
+    """An API detail in the stored row shape: every value a string, None as ''."""
+    return {key: '' if value is None else value if isinstance(value, str) else str(value) for key, value in detail.items()}
+
+def read_details(file_path=None, columns=None, script_ids=None):
+    """Rows of a detail dataset (DETAILED_CSV_PATH by default), optionally only some columns and scriptIds."""
+    file_path = file_path or config.DETAILED_CSV_PATH
+    if script_ids is not None:
+        script_ids = {str(script_id) for script_id in script_ids}
+    if detail_store.enabled():
+        return detail_store.read_rows(file_path, columns, script_ids)
+    rows = []
+    for row in iter_csv(file_path):
+        if script_ids is not None and row['scriptId'] not in script_ids:
+            continue
+        rows.append(row if columns is None else {key: row[key] for key in ('scriptId', *columns) if key in row})
+    return rows
+
+def read_detail_fieldnames(file_path):
+    """Column names of a detail dataset."""
+    return detail_store.read_fieldnames(file_path) if detail_store.enabled() else read_csv_header(file_path)
+
+def iter_detail_batches(file_path, batch_size):
+    """Yield a detail dataset's rows in scriptId order, in lists of up to batch_size."""
+    if detail_store.enabled():
+        yield from detail_store.iter_batches(file_path, batch_size)
+        return
+    batch = []
+    for row in iter_csv(file_path):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def write_detail_batches(file_path, fieldnames, batches):
+    """Replace a detail dataset with scriptId-ordered row batches; returns the number of rows written."""
+    if detail_store.enabled():
+        return detail_store.write_batches(file_path, fieldnames, batches)
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    temp_path = f"{file_path}.part"
+    written = 0
+    try:
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            for rows in batches:
+                writer.writerows(rows)
+                written += len(rows)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return written
+
+def merge_details(file_path, updates, merge, extra_fields=()):
+    """Merge updates (scriptId -> row) into a detail dataset; merge(existing_row or None, update) returns the row to keep or None."""
+    if detail_store.enabled():
+        return detail_store.merge_rows(file_path, updates, merge, extra_fields)
+
+    def merge_csv(row, update):
+        return row if update is None else merge(row, update)
+
+    return merge_sorted_csv(file_path, updates, merge_csv, extra_fields=extra_fields)
+
+def export_details():
+    """Write the Parquet detail datasets out as DETAILED_CSV_PATH and TRANSLATED_CSV_PATH."""
+    if detail_store.enabled() and config.EXPORT_DETAIL_CSV:
+        for file_path in (config.DETAILED_CSV_PATH, config.TRANSLATED_CSV_PATH):
+            detail_store.export_csv(file_path)
+
 def write_csv(file_path, data, fieldnames=None):
     """Write data to CSV with given or dynamically determined fieldnames."""
     if not data:
@@ -26,103 +111,325 @@ def write_csv(file_path, data, fieldnames=None):
         writer.writeheader()
         writer.writerows(data)
 
+def read_json(file_path, default=None):
+    """Read a JSON state file, returning default when it does not exist."""
+    if not os.path.exists(file_path):
+        return default
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json(file_path, data):
+    """Write a JSON state file."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def is_full_list_crawl_due(now=None):
+    """Return True when the last full script list crawl is older than FULL_LIST_CRAWL_INTERVAL."""
+    now = now or int(time.time())
+    state = read_json(config.LIST_CRAWL_STATE_PATH, default={})
+    return now - state.get('lastFullCrawlAt', 0) >= config.FULL_LIST_CRAWL_INTERVAL
+
+def request_full_list_crawl():
+    """Make the next incremental run do a full reconciliation crawl."""
+    state = read_json(config.LIST_CRAWL_STATE_PATH, default={})
+    state['lastFullCrawlAt'] = 0
+    write_json(config.LIST_CRAWL_STATE_PATH, state)
+
+def record_full_list_crawl(now=None):
+    """Remember when the last full script list crawl finished."""
+    state = read_json(config.LIST_CRAWL_STATE_PATH, default={})
+    state['lastFullCrawlAt'] = now or int(time.time())
+    write_json(config.LIST_CRAWL_STATE_PATH, state)
+
 def sort_csv_by_script_id(file_path):
     """Sort CSV by scriptId in ascending order."""
     data = read_csv(file_path)
     if data:
-        data.sort(key=lambda x: int(x['scriptId']) if x['scriptId'].isdigit() else x['scriptId'])
+        data.sort(key=lambda x: state_store.script_id_key(x['scriptId']))
         fieldnames = ['scriptId', 'scriptName'] + [key for key in data[0].keys() if key not in ['scriptId', 'scriptName']]
         write_csv(file_path, data, fieldnames)
         logging.info(f"Sorted {file_path} by scriptId")
 
+def read_csv_header(file_path):
+    """Column names of a CSV file, without reading its rows."""
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+class UnsortedCsvError(Exception):
+    """Raised by merge_sorted_csv when the existing file is not ordered by scriptId."""
+
+def merge_sorted_csv(file_path, updates, merge, extra_fields=()):
+    """Merge updates into a scriptId-sorted CSV in one streaming pass; returns the number of rows written."""
+    try:
+        return _merge_sorted_csv(file_path, updates, merge, extra_fields)
+    except UnsortedCsvError:
+        logging.warning(f"{file_path} is not sorted by scriptId, sorting it before merging")
+        sort_csv_by_script_id(file_path)
+        return _merge_sorted_csv(file_path, updates, merge, extra_fields)
+
+def _unique_sorted_rows(rows, file_path):
+    """Rows of a scriptId-sorted CSV, keeping the last of any rows sharing a scriptId."""
+    previous = None
+    previous_key = None
+    for row in rows:
+        key = state_store.script_id_key(row['scriptId'])
+        if previous is not None:
+            if key < previous_key:
+                raise UnsortedCsvError(file_path)
+            if key > previous_key:
+                yield previous
+        previous, previous_key = row, key
+    if previous is not None:
+        yield previous
+
+def _merge_sorted_csv(file_path, updates, merge, extra_fields):
+    header = read_csv_header(file_path)
+    known = set(header)
+    new_keys = sorted(({key for row in updates.values() for key in row} | set(extra_fields)) - known)
+    if header:
+        fieldnames = header + new_keys
+    else:
+        fieldnames = ['scriptId', 'scriptName'] + [key for key in new_keys if key not in ('scriptId', 'scriptName')]
+    pending = sorted(updates, key=state_store.script_id_key)
+    pending_index = 0
+    written = 0
+
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    temp_path = f"{file_path}.part"
+    try:
+        with open(temp_path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+
+            def emit(row):
+                nonlocal written
+                if row is not None:
+                    writer.writerow(row)
+                    written += 1
+
+            source = open(file_path, 'r', encoding='utf-8') if header else None
+            try:
+                for row in _unique_sorted_rows(csv.DictReader(source) if source else (), file_path):
+                    key = state_store.script_id_key(row['scriptId'])
+                    while pending_index < len(pending) and state_store.script_id_key(pending[pending_index]) < key:
+                        emit(merge(None, updates[pending[pending_index]]))
+                        pending_index += 1
+                    if pending_index < len(pending) and pending[pending_index] == row['scriptId']:
+                        emit(merge(row, updates[pending[pending_index]]))
+                        pending_index += 1
+                    else:
+                        emit(merge(row, None))
+            finally:
+                if source:
+                    source.close()
+            for script_id in pending[pending_index:]:
+                emit(merge(None, updates[script_id]))
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return written
+
 def update_script_list(new_data, mode='full'):
-    script_list_path = config.SCRIPT_LIST_PATH
-    inserted_count = 0
-    
+    """Store the crawled script list in the state store; returns the number of rows inserted."""
     if not new_data:
         logging.info("No new script data to update.")
-        return inserted_count
-    
-    current_time = int(time.time())
+        return 0
+
+    store = state_store.get_store()
     if mode == 'incremental':
-        existing_data = {row['scriptId']: row for row in read_csv(script_list_path)}
-        new_entries = []
-        for row in new_data:
-            script_id = row['scriptId']
-            if script_id not in existing_data:
-                row['databaseInserted'] = 'False'  # Set for new entries
-                new_entries.append(row)
-                inserted_count += 1
-            else:
-                existing_row = existing_data[script_id]
-                existing_row['scriptName'] = row['scriptName']
-                # Preserve flags including databaseInserted
-        all_data = list(existing_data.values()) + [row for row in new_entries if row['scriptId'] not in existing_data]
+        inserted_count = store.insert_new([dict(row, databaseInserted=False) for row in new_data])
     else:
-        all_data = [dict(row, databaseInserted='False') for row in new_data]  # All new with False
+        # Keep databaseInserted for known scripts; a changed contentFingerprint clears it in step 2
+        store.replace_all(new_data)
         inserted_count = len(new_data)
-    
-    if all_data:
-        fieldnames = ['scriptId', 'scriptName', 'firstFetchAt', 'lastModifiedAt',
-                      'coverImageDownloaded', 'imageContentDownloaded',
-                      'coverImageUploaded', 'imageContentUploaded', 'databaseInserted']
-        write_csv(script_list_path, all_data, fieldnames)
-        sort_csv_by_script_id(script_list_path)
     return inserted_count
 
-def update_script_details(new_details, mode='full'):
+def open_journal(journal_path):
+    """Open an append-only JSON Lines journal, creating its folder if needed."""
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+    needs_newline = False
+    if os.path.exists(journal_path) and os.path.getsize(journal_path) > 0:
+        with open(journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+    journal = open(journal_path, 'a', encoding='utf-8')
+    if needs_newline:
+        # Terminate a line truncated by a crash so the next record starts cleanly
+        journal.write('\n')
+    return journal
+
+def append_journal(journal, record):
+    """Append one record to an open journal and flush it so it survives a crash."""
+    journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+    journal.flush()
+
+def iter_journal(journal_path):
+    """Yield records from a JSON Lines journal, skipping a line truncated by a crash."""
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping malformed line {line_number} in {journal_path}")
+
+def read_journal_ids(journal_path):
+    """Return the set of scriptIds already recorded in a journal."""
+    return {str(record['scriptId']) for record in iter_journal(journal_path) if 'scriptId' in record}
+
+def update_script_details(new_details, mode='full', changed_ids=None):
+    """Merge new_details into the detailed dataset in batches; full mode drops scripts not in new_details."""
     detailed_csv_path = config.DETAILED_CSV_PATH
     inserted_count = 0
-    
-    if not new_details:
-        logging.info("No new script details to update.")
-        return inserted_count
-    
+    track_changes = changed_ids is not None
     current_time = int(time.time())
-    if mode == 'incremental':
-        existing_data = {row['scriptId']: row for row in read_csv(detailed_csv_path)}
-        new_entries = []
-        for detail in new_details:
-            script_id = detail['scriptId']
-            if script_id not in existing_data:
-                detail['firstFetchAt'] = current_time
-                new_entries.append(detail)
-                inserted_count += 1
+
+    def merge_incremental(existing_row, detail):
+        nonlocal inserted_count
+        script_id = detail['scriptId']
+        if existing_row is None:
+            detail['firstFetchAt'] = current_time
+            inserted_count += 1
+            if track_changes:
+                changed_ids.add(script_id)
+            return detail
+        if track_changes and existing_row.get('contentFingerprint') == detail.get('contentFingerprint'):
+            existing_row['lastFetchedAt'] = detail.get('lastFetchedAt', current_time)
+            return existing_row
+        existing_row.update(detail)
+        existing_row['lastModifiedAt'] = current_time
+        existing_row['firstFetchAt'] = existing_row.get('firstFetchAt') or current_time
+        if track_changes:
+            changed_ids.add(script_id)
+        return existing_row
+
+    def merge_full(existing_row, detail):
+        nonlocal inserted_count
+        inserted_count += 1
+        if track_changes:
+            if existing_row and existing_row.get('contentFingerprint') == detail.get('contentFingerprint'):
+                detail['lastModifiedAt'] = existing_row.get('lastModifiedAt', detail.get('lastModifiedAt'))
             else:
-                existing_row = existing_data[script_id]
-                existing_row.update(detail)
-                existing_row['lastModifiedAt'] = current_time
-                existing_row['firstFetchAt'] = existing_row.get('firstFetchAt', current_time)
-        all_data = list(existing_data.values()) + [row for row in new_entries if row['scriptId'] not in existing_data]
-    else:
-        all_data = new_details
-        inserted_count = len(new_details)
-    
-    if all_data:
-        write_csv(detailed_csv_path, all_data)  # No fieldnames specified, uses all keys
-        sort_csv_by_script_id(detailed_csv_path)
+                changed_ids.add(detail['scriptId'])
+        return detail
+
+    def flush(updates):
+        merge_details(detailed_csv_path, updates, merge_incremental if mode == 'incremental' else merge_full,
+                      extra_fields=('firstFetchAt', 'lastModifiedAt', 'lastFetchedAt'))
+        updates.clear()
+
+    updates = {}
+    merged_ids = set()
+    for detail in new_details:
+        detail['scriptId'] = str(detail['scriptId'])
+        updates[detail['scriptId']] = detail
+        merged_ids.add(detail['scriptId'])
+        if len(updates) >= config.DETAIL_MERGE_BATCH_SIZE:
+            flush(updates)
+    if not merged_ids:
+        logging.info("No new script details to update.")
+        return inserted_count
+    if updates:
+        flush(updates)
+
+    if mode != 'incremental':
+        # Batches keep the rows they do not touch; scripts absent from every batch are dropped once at the end
+        dropped_ids = {row['scriptId'] for row in read_details(columns=())} - merged_ids
+        if dropped_ids:
+            merge_details(detailed_csv_path, {script_id: {} for script_id in dropped_ids}, lambda existing_row, detail: None)
+            logging.info(f"Dropped {len(dropped_ids)} scripts missing from the full detail refresh")
+    if track_changes:
+        logging.info(f"{len(changed_ids)} script details new or changed by contentFingerprint")
+    return inserted_count
+
+def update_script_details_from_journal(journal_path, mode='full', changed_ids=None):
+    """Stream the detail journal into the detailed dataset, then remove the consumed journal."""
+    if not os.path.exists(journal_path):
+        logging.info(f"No detail journal at {journal_path}")
+        return 0
+    inserted_count = update_script_details(iter_journal(journal_path), mode=mode, changed_ids=changed_ids)
+    os.remove(journal_path)
+    logging.info(f"Consumed detail journal {journal_path}")
     return inserted_count
 
+# Detail columns refresh_priority reads
+REFRESH_FIELDS = ('lastFetchedAt', 'lastModifiedAt', 'firstFetchAt', *config.DETAIL_REFRESH_WEIGHTS)
+
+def _to_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def refresh_priority(row, now):
+    """Staleness in hours since the last fetch, weighted by the row's popularity signals."""
+    fetched_at = row.get('lastFetchedAt') or row.get('lastModifiedAt') or row.get('firstFetchAt') or 0
+    age = now - int(_to_float(fetched_at))
+    if age < config.DETAIL_REFRESH_MIN_AGE:
+        return 0.0
+    popularity = sum(
+        weight * math.log1p(max(_to_float(row.get(field)), 0.0))
+        for field, weight in config.DETAIL_REFRESH_WEIGHTS.items()
+    )
+    return (age / 3600) * (1 + popularity)
+
+def select_refresh_candidates(detail_rows, budget, exclude_ids=(), now=None):
+    """Pick up to budget existing scriptIds whose details are most worth re-fetching."""
+    now = now or int(time.time())
+    scored = (
+        (refresh_priority(row, now), row['scriptId'])
+        for row in detail_rows if row['scriptId'] not in exclude_ids
+    )
+    selected = [script_id for priority, script_id in heapq.nlargest(budget, scored) if priority > 0]
+    logging.info(f"Selected {len(selected)} existing scripts for detail refresh (budget {budget})")
+    return selected
+
 def update_script_list_flags(updated_data):
-    script_list_path = config.SCRIPT_LIST_PATH
-    current_data = {row['scriptId']: row for row in read_csv(script_list_path)}
-    
-    flag_fields = ['coverImageDownloaded', 'imageContentDownloaded', 'coverImageUploaded', 'imageContentUploaded', 'databaseInserted']
-    
-    for item in updated_data:
-        script_id = item['scriptId']
-        if script_id in current_data:
-            current_row = current_data[script_id]
-            for field in flag_fields:
-                if field in item and current_row.get(field) != 'True':
-                    current_row[field] = str(item[field])
-            # Preserve firstFetchAt, lastModifiedAt unchanged here
-
-    all_data = list(current_data.values())
-    if all_data:
-        fieldnames = ['scriptId', 'scriptName', 'firstFetchAt', 'lastModifiedAt',
-                      'coverImageDownloaded', 'imageContentDownloaded',
-                      'coverImageUploaded', 'imageContentUploaded', 'databaseInserted']
-        write_csv(script_list_path, all_data, fieldnames)
-        sort_csv_by_script_id(script_list_path)
-    logging.info(f"Updated flags in {script_list_path}")
\ No newline at end of file
+    """Set flags from updated rows in the state store; a flag that is already True is kept."""
+    flags = {
+        item['scriptId']: {field: item[field] for field in state_store.FLAG_FIELDS if field in item}
+        for item in updated_data
+    }
+    changed_count = state_store.get_store().set_flags(flags, only_set=True)
+    logging.info(f"Updated flags on {changed_count} scripts in {config.STATE_DB_PATH}")
+
+def mark_scripts_dirty(script_ids):
+    """Clear databaseInserted for scripts whose details changed so step 6 imports them again."""
+    if not script_ids:
+        return
+    dirty_count = state_store.get_store().clear_flag('databaseInserted', script_ids)
+    logging.info(f"Marked {dirty_count} changed scripts for re-import in {config.STATE_DB_PATH}")
+
+def set_script_list_flags(flags):
+    """Overwrite flags from {scriptId: {field: value}}, True to False included; returns the rows changed."""
+    changed_count = state_store.get_store().set_flags(flags)
+    logging.info(f"Reset flags on {changed_count} scripts in {config.STATE_DB_PATH}")
+    return changed_count
+
+def read_script_list():
+    """Every script list row from the state store, in the SCRIPT_LIST_PATH shape."""
+    return state_store.get_store().rows()
+
+def scripts_needing(*flag_fields):
+    """Script list rows with any of the given flags still False."""
+    return state_store.get_store().needing(*flag_fields)
+
+def read_script_records():
+    """Every script list entry as a compact ScriptRecord."""
+    return state_store.get_store().records()
+
+def script_records_needing(*flag_fields):
+    """ScriptRecords with any of the given flags still False."""
+    return state_store.get_store().records_needing(*flag_fields)
+
+def export_script_list(file_path=None):
+    """Write the state store out as SCRIPT_LIST_PATH for tools that read the CSV."""
+    state_store.get_store().export_csv(file_path or config.SCRIPT_LIST_PATH)
\ No newline at end of file
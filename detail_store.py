@@ -0,0 +1,174 @@
+import csv
+import logging
+import os
+import config
+from state_store import script_id_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # the CSV files stay the primary format
+    pa = None
+
+# Parquet file of each detail dataset, keyed by the CSV path callers use to name the dataset
+PARQUET_PATHS = {
+    config.DETAILED_CSV_PATH: config.DETAILED_PARQUET_PATH,
+    config.TRANSLATED_CSV_PATH: config.TRANSLATED_PARQUET_PATH,
+}
+
+def enabled():
+    """True when detail datasets live in Parquet: pyarrow is installed and DETAIL_STORE_FORMAT asks for it."""
+    return pa is not None and config.DETAIL_STORE_FORMAT == 'parquet'
+
+def parquet_path(csv_path):
+    return PARQUET_PATHS.get(csv_path) or os.path.splitext(csv_path)[0] + '.parquet'
+
+def _cell(value):
+    """Store every value as a string like the CSV did, with empty values as nulls."""
+    if value is None or value == '':
+        return None
+    return value if isinstance(value, str) else str(value)
+
+def _row(row):
+    """A stored row in the CSV row shape, nulls read back as ''."""
+    return {key: '' if value is None else value for key, value in row.items()}
+
+def _fieldnames(header, rows, extra_fields=()):
+    """Existing columns in order, then any new keys: scriptId and scriptName first, the rest sorted."""
+    new_keys = sorted(({key for row in rows for key in row} | set(extra_fields)) - set(header))
+    if header:
+        return list(header) + new_keys
+    return ['scriptId', 'scriptName'] + [key for key in new_keys if key not in ('scriptId', 'scriptName')]
+
+def table_from_rows(rows, fieldnames):
+    return pa.table({name: pa.array([_cell(row.get(name)) for row in rows], pa.string()) for name in fieldnames})
+
+def _with_columns(table, fieldnames):
+    """table with fieldnames as its columns, in that order; missing ones are all null."""
+    for name in fieldnames:
+        if name not in table.schema.names:
+            table = table.append_column(name, pa.nulls(table.num_rows, pa.string()))
+    return table.select(fieldnames)
+
+def _sort(table):
+    ids = table.column('scriptId').to_pylist()
+    return table.take(sorted(range(len(ids)), key=lambda i: script_id_key(ids[i])))
+
+def _write(path, table):
+    """Replace path with table, sorted by scriptId so row group statistics narrow scriptId filters."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.part"
+    try:
+        pq.write_table(_sort(table), temp_path, row_group_size=config.DETAIL_ROW_GROUP_SIZE)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def migrate(csv_path):
+    """Load a dataset's CSV into Parquet the first time the store is used."""
+    path = parquet_path(csv_path)
+    if os.path.exists(path) or not os.path.exists(csv_path):
+        return
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        # Older full runs could write a scriptId twice; the last row wins
+        rows = list({row['scriptId']: row for row in reader}.values())
+        header = reader.fieldnames or []
+    _write(path, table_from_rows(rows, _fieldnames(header, rows)))
+    logging.info(f"Imported {len(rows)} rows from {csv_path} into {path}")
+
+def read_table(csv_path, columns=None, script_ids=None):
+    """Read a dataset as an Arrow table, or None when it does not exist yet."""
+    migrate(csv_path)
+    path = parquet_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [name for name in dict.fromkeys(['scriptId', *columns]) if name in available]
+    filters = None
+    if script_ids is not None:
+        filters = [('scriptId', 'in', sorted({str(script_id) for script_id in script_ids}, key=script_id_key))]
+    return pq.read_table(path, columns=columns, filters=filters)
+
+def read_rows(csv_path, columns=None, script_ids=None):
+    """Rows of a dataset as dicts in the CSV row shape; see read_table for columns and script_ids."""
+    if script_ids is not None and not script_ids:
+        return []
+    table = read_table(csv_path, columns, script_ids)
+    return [] if table is None else [_row(row) for row in table.to_pylist()]
+
+def read_fieldnames(csv_path):
+    """Column names of a dataset, without reading its rows."""
+    migrate(csv_path)
+    path = parquet_path(csv_path)
+    return pq.read_schema(path).names if os.path.exists(path) else []
+
+def iter_batches(csv_path, batch_size):
+    """Yield a dataset's rows in lists of up to batch_size, decoding one batch at a time."""
+    migrate(csv_path)
+    path = parquet_path(csv_path)
+    if not os.path.exists(path):
+        return
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield [_row(row) for row in batch.to_pylist()]
+
+def write_batches(csv_path, fieldnames, batches):
+    """Replace a dataset with row batches sorted by scriptId; returns the number of rows written."""
+    path = parquet_path(csv_path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.part"
+    written = 0
+    try:
+        with pq.ParquetWriter(temp_path, pa.schema([(name, pa.string()) for name in fieldnames])) as writer:
+            for rows in batches:
+                writer.write_table(table_from_rows(rows, fieldnames), row_group_size=config.DETAIL_ROW_GROUP_SIZE)
+                written += len(rows)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return written
+
+def merge_rows(csv_path, updates, merge, extra_fields=()):
+    """Merge updates (scriptId -> row) into a dataset, keeping untouched rows as Arrow data; returns the rows stored."""
+    table = read_table(csv_path)
+    header = [] if table is None else table.schema.names
+    existing = {}
+    if table is not None:
+        in_batch = pc.is_in(table.column('scriptId'), value_set=pa.array(list(updates), pa.string()))
+        existing = {row['scriptId']: _row(row) for row in table.filter(in_batch).to_pylist()}
+        table = table.filter(pc.invert(in_batch))
+
+    merged = []
+    for script_id, update in updates.items():
+        row = merge(existing.get(script_id), update)
+        if row is not None:
+            merged.append(row)
+    fieldnames = _fieldnames(header, merged, extra_fields)
+    parts = [table_from_rows(merged, fieldnames)]
+    if table is not None and table.num_rows:
+        parts.append(_with_columns(table, fieldnames))
+    result = pa.concat_tables(parts)
+    _write(parquet_path(csv_path), result)
+    return result.num_rows
+
+def export_csv(csv_path, batch_size=1024):
+    """Write a dataset out as its CSV file, streaming it in batches."""
+    path = parquet_path(csv_path)
+    if not os.path.exists(path):
+        return
+    parquet_file = pq.ParquetFile(path)
+    os.makedirs(os.path.dirname(csv_path) or '.', exist_ok=True)
+    temp_path = f"{csv_path}.part"
+    with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=parquet_file.schema_arrow.names)
+        writer.writeheader()
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            writer.writerows(_row(row) for row in batch.to_pylist())
+    os.replace(temp_path, csv_path)
+    logging.info(f"Exported {parquet_file.metadata.num_rows} rows from {path} to {csv_path}")
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import aiohttp
+import config
+
+class TokenBucket:
+    """Token-bucket rate limiter allowing `rate` requests per second with bursts up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class CircuitBreaker:
+    """Per-host breaker: opens after consecutive failures and lets one probe through per reset window."""
+
+    def __init__(self, host, failure_threshold, reset_timeout):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == 'closed':
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # Half-open: restart the window so only this request probes the host
+            self.state = 'half_open'
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != 'closed':
+            logging.info(f"Circuit for {self.host} closed after a successful probe")
+        self.state = 'closed'
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logging.warning(f"Circuit for {self.host} opened after {self.failures} consecutive failures")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+class RetryBudget:
+    """Global retry allowance: a fixed floor plus `ratio` retries per request sent."""
+
+    def __init__(self, ratio, min_retries):
+        self.ratio = ratio
+        self.balance = float(min_retries)
+
+    def record_request(self):
+        self.balance += self.ratio
+
+    def try_spend(self):
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        return False
+
+def is_retryable_status(status):
+    """Server errors and rate limiting are worth retrying; other 4xx will fail the same way again."""
+    return status >= 500 or status in (408, 429)
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff so retrying tasks do not wake up in lockstep."""
+    return random.uniform(0, min(config.RETRY_BACKOFF_CAP, config.RETRY_BACKOFF_BASE * 2 ** attempt))
+
+class HttpClient:
+    """Long-lived aiohttp session shared by every crawl and download step of a run."""
+
+    def __init__(self):
+        self.session = None
+        self.stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+            'retries': 0,
+            'fast_failures': 0,
+        }
+        self.retry_budget = RetryBudget(config.RETRY_BUDGET_RATIO, config.RETRY_BUDGET_MIN)
+        self._breakers = {}
+        self._rate_limiters = {
+            host: TokenBucket(rate, max(1, rate)) for host, rate in config.HTTP_HOST_RATE_LIMITS.items()
+        }
+        self._host_limits = {
+            host: asyncio.Semaphore(limit) for host, limit in config.HTTP_HOST_LIMITS.items()
+        }
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._counter('requests'))
+        trace_config.on_connection_create_end.append(self._counter('connections_created'))
+        trace_config.on_connection_reuseconn.append(self._counter('connections_reused'))
+        trace_config.on_dns_cache_hit.append(self._counter('dns_cache_hits'))
+        trace_config.on_dns_cache_miss.append(self._counter('dns_cache_misses'))
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_CONNECTION_LIMIT,
+            ttl_dns_cache=config.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+            enable_cleanup_closed=True
+        )
+        self.session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+        logging.debug(f"Opened shared HTTP client with host limits {config.HTTP_HOST_LIMITS}")
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            self.log_stats()
+
+    def _counter(self, key):
+        async def handler(session, trace_config_ctx, params):
+            self.stats[key] += 1
+        return handler
+
+    def connection_reuse_ratio(self):
+        """Share of requests served on an already-open connection."""
+        total = self.stats['connections_created'] + self.stats['connections_reused']
+        return self.stats['connections_reused'] / total if total else 0.0
+
+    def log_stats(self):
+        logging.info(f"HTTP client: {self.stats['requests']} requests, "
+                     f"{self.stats['connections_created']} connections opened, "
+                     f"{self.stats['connections_reused']} reused ({self.connection_reuse_ratio():.1%}), "
+                     f"DNS cache {self.stats['dns_cache_hits']} hits / {self.stats['dns_cache_misses']} misses, "
+                     f"{self.stats['retries']} retries, {self.stats['fast_failures']} fast failures")
+
+    def breaker(self, host):
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker(host, config.CIRCUIT_FAILURE_THRESHOLD, config.CIRCUIT_RESET_TIMEOUT)
+        return self._breakers[host]
+
+    async def call(self, method, url, handler, description, **kwargs):
+        """Send a request through the host's rate limiter and circuit breaker; returns handler(response), or None on failure."""
+        host = urlsplit(url).hostname
+        breaker = self.breaker(host)
+        rate_limiter = self._rate_limiters.get(host)
+        kwargs.setdefault('timeout', aiohttp.ClientTimeout(total=config.REQUEST_TIMEOUT))
+        for attempt in range(config.TIMEOUT_RETRY_LIMIT):
+            if not breaker.allow():
+                self.stats['fast_failures'] += 1
+                logging.warning(f"Circuit open for {host}, failing fast on {description}")
+                return None
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
+            self.retry_budget.record_request()
+            try:
+                logging.info(f"Requesting {description}, attempt {attempt+1}")
+                async with self.request(method, url, **kwargs) as response:
+                    result = await handler(response)
+                breaker.record_success()
+                return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and not is_retryable_status(e.status):
+                    # The host answered, so a missing or rejected resource says nothing about its health
+                    breaker.record_success()
+                    logging.warning(f"HTTP {e.status} for {description}, not retrying")
+                    return None
+                breaker.record_failure()
+                logging.warning(f"Attempt {attempt+1} failed for {description}: {str(e)}")
+                if attempt == config.TIMEOUT_RETRY_LIMIT - 1:
+                    logging.error(f"Failed after {config.TIMEOUT_RETRY_LIMIT} retries for {description}: {str(e)}")
+                    return None
+                if not self.retry_budget.try_spend():
+                    logging.error(f"Retry budget exhausted, giving up on {description}: {str(e)}")
+                    return None
+                self.stats['retries'] += 1
+                await asyncio.sleep(backoff_delay(attempt))
+        return None
+
+    @asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        """Issue a request, waiting for a slot when the host has a configured limit."""
+        host_limit = self._host_limits.get(urlsplit(url).hostname)
+        if host_limit is None:
+            async with self.session.request(method, url, **kwargs) as response:
+                yield response
+        else:
+            async with host_limit:
+                async with self.session.request(method, url, **kwargs) as response:
+                    yield response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+@asynccontextmanager
+async def borrow(client=None):
+    """Yield the given client, or a temporary one that is closed on exit."""
+    if client is not None:
+        yield client
+    else:
+        async with HttpClient() as temporary_client:
+            yield temporary_client
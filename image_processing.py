@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image
+import config
+
+def _encode(img, image_format, quality, scale):
+    """Encode img at the given quality and downscale factor, returning the bytes."""
+    if scale < 1:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    buffer = BytesIO()
+    if image_format == "JPEG":
+        img.save(buffer, "JPEG", quality=quality, progressive=True, optimize=True)
+    else:
+        img.save(buffer, image_format, quality=quality, method=4)
+    return buffer.getvalue()
+
+def encode_to_budget(img, image_format, budget):
+    """Encode at the highest quality that fits budget, downscaling only if needed; returns (data, quality, scale)."""
+    smallest = None
+    for scale in config.IMAGE_DOWNSCALE_STEPS:
+        low, high = config.IMAGE_MIN_QUALITY, config.IMAGE_MAX_QUALITY
+        best = None
+        while low <= high:
+            quality = (low + high) // 2
+            data = _encode(img, image_format, quality, scale)
+            if smallest is None or len(data) < len(smallest[0]):
+                smallest = (data, quality, scale)
+            if len(data) <= budget:
+                best = (data, quality, scale)
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is not None:
+            return best
+    return smallest
+
+def needs_encoding(image_path, size, budget):
+    """Over-budget images always; lossless files under budget only when bloated per pixel."""
+    if size > budget:
+        return True
+    if os.path.splitext(image_path)[1].lower() not in ('.png', '.bmp'):
+        return False
+    with Image.open(image_path) as img:
+        return size / max(1, img.width * img.height) > config.IMAGE_MAX_LOSSLESS_BYTES_PER_PIXEL
+
+def compress_image(image_path, size=None):
+    """Re-encode an image to fit IMAGE_BYTE_BUDGET and return its size on disk."""
+    if size is None:
+        size = os.path.getsize(image_path)
+    budget = config.IMAGE_BYTE_BUDGET
+    try:
+        if not needs_encoding(image_path, size, budget):
+            return size
+        start = time.monotonic()
+        extension = os.path.splitext(image_path)[1].lower()
+        image_format = {'.webp': "WEBP", '.jpg': "JPEG", '.jpeg': "JPEG"}.get(extension, config.IMAGE_ENCODE_FORMAT)
+        with Image.open(image_path) as img:
+            keep_alpha = image_format == "WEBP" and 'A' in img.getbands()
+            img = img.convert("RGBA" if keep_alpha else "RGB")
+            data, quality, scale = encode_to_budget(img, image_format, budget)
+        elapsed = time.monotonic() - start
+        if len(data) >= size:
+            logging.info(f"Kept {image_path}: best {image_format} encoding ({len(data)} bytes) is not smaller than {size} bytes")
+            return size
+        temp_path = f"{image_path}.part"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, image_path)
+        logging.info(f"Compressed {image_path}: {size} -> {len(data)} bytes (ratio {len(data) / size:.2f}, "
+                     f"{image_format} q={quality} scale={scale}) in {elapsed:.2f}s")
+        return len(data)
+    except Exception as e:
+        logging.error(f"Failed to compress {image_path}: {str(e)}")
+    return size
+
+def derivative_path(sha256, width, extension):
+    """Location of one derivative, keyed by the source image hash so a new source gets new files."""
+    return os.path.join(config.IMAGE_DERIVATIVE_FOLDER, sha256[:2], sha256, f"{width}{extension}")
+
+def planned_derivatives(sha256):
+    """Every configured (width, format, path) derivative for a source image."""
+    return [
+        (width, image_format, derivative_path(sha256, width, extension))
+        for width in config.IMAGE_DERIVATIVE_WIDTHS
+        for image_format, extension in config.IMAGE_DERIVATIVE_FORMATS.items()
+    ]
+
+def missing_derivative_widths(sha256):
+    """Widths that still lack at least one configured format."""
+    return sorted({width for width, _, path in planned_derivatives(sha256) if not os.path.exists(path)})
+
+def render_derivatives(source_path, sha256, width):
+    """Resize a stored image to `width` px and encode each missing format; returns the paths written."""
+    written = []
+    with Image.open(source_path) as img:
+        img = img.convert("RGB")
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        for image_format, extension in config.IMAGE_DERIVATIVE_FORMATS.items():
+            path = derivative_path(sha256, width, extension)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.part"
+            img.save(temp_path, image_format, quality=config.IMAGE_DERIVATIVE_QUALITY)
+            os.replace(temp_path, path)
+            written.append(path)
+    return written
+
+class ImageProcessingStage:
+    """Process-pool stage for CPU-bound image post-processing, fed by a bounded queue."""
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or config.IMAGE_PROCESSING_WORKERS or os.cpu_count() or 1
+        self.queue = asyncio.Queue(maxsize=queue_size or config.IMAGE_PROCESSING_QUEUE_SIZE or self.workers * 2)
+        self.executor = None
+        self.consumers = []
+        self.started_at = None
+        self.stats = {
+            'processed': 0,
+            'failed': 0,
+            'busy_seconds': 0.0,
+            'producer_wait_seconds': 0.0,
+            'max_queue_depth': 0,
+            'queue_depth_total': 0,
+            'queue_depth_samples': 0,
+        }
+
+    async def __aenter__(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        self.started_at = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for _ in self.consumers:
+            await self.queue.put(None)
+        await asyncio.gather(*self.consumers)
+        self.executor.shutdown()
+        self.log_stats()
+
+    async def submit(self, func, *args):
+        """Queue func(*args) for a worker process and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        wait_start = time.monotonic()
+        await self.queue.put((func, args, future))
+        self.stats['producer_wait_seconds'] += time.monotonic() - wait_start
+        depth = self.queue.qsize()
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], depth)
+        self.stats['queue_depth_total'] += depth
+        self.stats['queue_depth_samples'] += 1
+        return await future
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            func, args, future = item
+            start = time.monotonic()
+            try:
+                future.set_result(await loop.run_in_executor(self.executor, func, *args))
+            except Exception as e:
+                self.stats['failed'] += 1
+                future.set_exception(e)
+            finally:
+                self.stats['processed'] += 1
+                self.stats['busy_seconds'] += time.monotonic() - start
+
+    def log_stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        utilization = self.stats['busy_seconds'] / (elapsed * self.workers)
+        samples = self.stats['queue_depth_samples']
+        average_depth = self.stats['queue_depth_total'] / samples if samples else 0.0
+        bound = 'CPU-bound' if self.stats['producer_wait_seconds'] > 0.1 * elapsed or utilization > 0.8 else 'network-bound'
+        logging.info(f"Image processing: {self.stats['processed']} jobs ({self.stats['failed']} failed) "
+                     f"in {elapsed:.1f}s on {self.workers} workers, "
+                     f"{self.stats['processed'] / elapsed:.2f} jobs/s, utilization {utilization:.0%}, "
+                     f"queue depth avg {average_depth:.1f} / max {self.stats['max_queue_depth']}, "
+                     f"producers waited {self.stats['producer_wait_seconds']:.1f}s -> {bound}")
@@ -0,0 +1,46 @@
+import json
+import logging
+import os
+import shutil
+import config
+
+def store_path_for(sha256, extension):
+    """Location of an image in the content-addressed store, sharded by the first hash byte."""
+    return os.path.join(config.IMAGE_STORE_FOLDER, sha256[:2], f"{sha256}{extension.lower()}")
+
+def add_to_store(temp_path, sha256, extension, size):
+    """Move a downloaded file into the store; returns {'path', 'size', 'sha256', 'new'}."""
+    store_path = store_path_for(sha256, extension)
+    if os.path.exists(store_path):
+        os.remove(temp_path)
+        return {'path': store_path, 'size': os.path.getsize(store_path), 'sha256': sha256, 'new': False}
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    os.replace(temp_path, store_path)
+    return {'path': store_path, 'size': size, 'sha256': sha256, 'new': True}
+
+def link_into(store_path, target_path):
+    """Expose a stored image under a per-script filename as a hard link (copy when linking fails)."""
+    if os.path.exists(target_path):
+        if os.path.samefile(store_path, target_path):
+            return
+        os.remove(target_path)
+    try:
+        os.link(store_path, target_path)
+    except OSError as e:
+        logging.debug(f"Hard link {target_path} -> {store_path} failed ({e}), copying instead")
+        shutil.copyfile(store_path, target_path)
+
+def load_manifest():
+    """Read the URL -> stored image manifest."""
+    if not os.path.exists(config.IMAGE_MANIFEST_PATH):
+        return {}
+    with open(config.IMAGE_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    """Atomically rewrite the URL -> stored image manifest."""
+    os.makedirs(os.path.dirname(config.IMAGE_MANIFEST_PATH), exist_ok=True)
+    temp_path = f"{config.IMAGE_MANIFEST_PATH}.part"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temp_path, config.IMAGE_MANIFEST_PATH)
@@ -8,9 +8,13 @@ import cloudinary_upload
 from logging_config import setup_logger
 import asyncio
 import prisma_operations
+import http_client
+import upload_queue
+import pipeline
+import records
 import time
 
-def main(mode='incremental', log_level='INFO', start_step=1, fetch_images=True, upload_images=True):
+def main(mode='incremental', log_level='INFO', start_step=1, fetch_images=True, upload_images=True, remote_ingest=config.CLOUDINARY_REMOTE_INGEST, pipeline_mode=False):
     # Set up logging
     log_file = setup_logger(log_level=log_level, log_folder=config.LOG_FOLDER)
     logging.info(f"Starting cron job in {mode} mode from step {start_step}. Log file: {log_file}")
@@ -22,104 +26,182 @@ def main(mode='incremental', log_level='INFO', start_step=1, fetch_images=True,
     os.makedirs(config.SCRIPT_IMAGE_CONTENT_FOLDER, exist_ok=True)
     os.makedirs(config.INCREMENTAL_OUTPUT_FOLDER_PATH, exist_ok=True)
 
+    # Run every step in one event loop so the pooled HTTP client is shared across steps
+    try:
+        asyncio.run(run(mode, start_step, fetch_images, upload_images, remote_ingest, pipeline_mode))
+    finally:
+        # Flags live in STATE_DB_PATH and details in Parquet; keep the CSV copies current for anything that still reads them
+        data_update.export_script_list()
+        data_update.export_details()
+
+async def run(mode, start_step, fetch_images, upload_images, remote_ingest=False, pipeline_mode=False):
+    async with http_client.HttpClient() as client:
+        await run_steps(client, mode, start_step, fetch_images, upload_images, remote_ingest, pipeline_mode)
+
+async def run_steps(client, mode, start_step, fetch_images, upload_images, remote_ingest=False, pipeline_mode=False):
     # Step 1: Fetch and update script list
     if start_step <= 1:
-        script_list = web_scraping.fetch_script_list_sync()
+        # The delta crawl only sees new scripts on its first pages when the listing is ordered newest-first
+        if mode == 'incremental' and config.DELTA_LIST_PAYLOAD_OVERRIDES and not data_update.is_full_list_crawl_due():
+            known_ids = {s['scriptId'] for s in data_update.read_script_list()}
+            try:
+                script_list = await web_scraping.fetch_script_list(known_ids, client=client)
+                logging.info(f"Step 1: Delta crawl returned {len(script_list)} scripts")
+            except web_scraping.ListCrawlError as e:
+                # New scripts may have been missed; the next run reconciles with a full crawl
+                logging.error(f"Step 1: Delta crawl abandoned: {str(e)}")
+                data_update.request_full_list_crawl()
+                script_list = []
+        else:
+            try:
+                script_list = await web_scraping.fetch_script_list(client=client)
+                data_update.record_full_list_crawl()
+                logging.info(f"Step 1: Full reconciliation crawl returned {len(script_list)} scripts")
+            except web_scraping.ListCrawlError as e:
+                # Not recorded as done, so the next run tries the reconciliation crawl again
+                logging.error(f"Step 1: Full reconciliation crawl abandoned, keeping the stored script list: {str(e)}")
+                script_list = []
         inserted_count = data_update.update_script_list(script_list, mode=mode)
         logging.info(f"Step 1: Script list updated. {inserted_count} new records inserted.")
-        if mode == 'incremental':
-            existing_scripts = data_update.read_csv(config.SCRIPT_LIST_PATH)
-            existing_ids = {s['scriptId'] for s in existing_scripts}
-            new_scripts = [s for s in script_list if s['scriptId'] not in existing_ids]
-            updated_scripts = existing_scripts + new_scripts
-            data_update.write_csv(config.SCRIPT_LIST_PATH, updated_scripts)
-            logging.info(f"Step 1: Appended {len(new_scripts)} new scripts to SCRIPT_LIST_PATH")
-        else:
-            data_update.write_csv(config.SCRIPT_LIST_PATH, script_list)
-            logging.info(f"Step 1: Overwrote SCRIPT_LIST_PATH with {len(script_list)} scripts in full mode")
+        if mode != 'incremental':
+            logging.info(f"Step 1: Rebuilt the script list with {len(script_list)} scripts in full mode")
     else:
-        script_list = data_update.read_csv(config.SCRIPT_LIST_PATH)
-        logging.debug(f"Skipping Step 1, loaded {len(script_list)} scripts from {config.SCRIPT_LIST_PATH}")
+        script_list = data_update.read_script_list()
+        logging.debug(f"Skipping Step 1, loaded {len(script_list)} scripts from {config.STATE_DB_PATH}")
 
     # Step 2: Fetch and update script details
     if start_step <= 2:
         if mode == 'incremental':
-            existing_scripts = data_update.read_csv(config.SCRIPT_LIST_PATH)
-            existing_details = {row['scriptId'] for row in data_update.read_csv(config.DETAILED_CSV_PATH)}
-            new_script_ids = [s['scriptId'] for s in existing_scripts if s['scriptId'] not in existing_details]
+            detail_rows = data_update.read_details(columns=data_update.REFRESH_FIELDS)
+            existing_details = {row['scriptId'] for row in detail_rows}
+            new_script_ids = [record.key for record in data_update.read_script_records() if record.key not in existing_details]
             logging.debug(f"New script IDs to fetch in incremental mode: {len(new_script_ids)}")
+            # Spend a fixed per-run budget keeping stale but popular scripts fresh
+            new_script_ids += data_update.select_refresh_candidates(detail_rows, config.DETAIL_REFRESH_BUDGET)
+            del detail_rows
         else:
             new_script_ids = [s['scriptId'] for s in script_list]
             logging.debug(f"Fetching all {len(new_script_ids)} script IDs in full mode")
         
+        if pipeline_mode:
+            # Steps 2-6 run per script as a stream instead of as global phases; scripts left
+            # unfinished by earlier runs are streamed again when this run can finish them
+            queued_ids = set(new_script_ids)
+            new_script_ids += [
+                script_id for script_id in pipeline.resumable_script_ids(fetch_images, upload_images, remote_ingest)
+                if script_id not in queued_ids
+            ]
+            await pipeline.run_pipeline(client, new_script_ids, mode, fetch_images, upload_images, remote_ingest)
+            return
+
         if new_script_ids:
-            new_details = web_scraping.fetch_script_details_sync(new_script_ids)
-            details_inserted_count = data_update.update_script_details(new_details, mode=mode)
-            logging.info(f"Step 2: Detailed data updated. {details_inserted_count} new records inserted.")
+            fetched_count = await web_scraping.fetch_script_details(new_script_ids, client=client)
+            logging.info(f"Step 2: Journaled {fetched_count} script details")
         else:
-            new_details = []
             logging.info("Step 2: No new script IDs to fetch.")
+        # Also consumes details left in the journal by an interrupted run
+        changed_ids = set()
+        details_inserted_count = data_update.update_script_details_from_journal(config.DETAIL_JOURNAL_PATH, mode=mode, changed_ids=changed_ids)
+        data_update.mark_scripts_dirty(changed_ids)
+        logging.info(f"Step 2: Detailed data updated. {details_inserted_count} new records inserted, "
+                     f"{len(changed_ids)} scripts new or changed.")
     else:
-        new_details = []
-        logging.debug("Skipping Step 2, new_details set to empty list")
+        logging.debug("Skipping Step 2")
 
     # Step 3: Download images and update details and script list flags
     if start_step <= 3:
-        if mode == 'incremental':
-            existing_scripts = data_update.read_csv(config.SCRIPT_LIST_PATH)
-            # Filter scripts needing image downloads based on flags
-            scripts_to_download = [
-                script for script in existing_scripts
-                if script.get('coverImageDownloaded', 'False') == 'False' or 
-                   script.get('imageContentDownloaded', 'False') == 'False'
-            ]
-            # Load existing details from DETAILED_CSV_PATH to get URLs
-            detailed_data = {row['scriptId']: row for row in data_update.read_csv(config.DETAILED_CSV_PATH)}
-            # Merge details into scripts_to_download
-            scripts_to_download_dict = {script['scriptId']: script for script in scripts_to_download}
-            for script_id, script in scripts_to_download_dict.items():
-                if script_id in detailed_data:
-                    script.update(detailed_data[script_id])
-                else:
-                    logging.debug(f"scriptId={script_id} needs download but has no details in DETAILED_CSV_PATH")
-            # Merge new_details if available
-            for detail in new_details:
-                if detail['scriptId'] in scripts_to_download_dict:
-                    scripts_to_download_dict[detail['scriptId']].update(detail)
-            scripts_to_download = list(scripts_to_download_dict.values())
+        if remote_ingest:
+            # Download flags never become True in this mode, so no details are loaded for them
+            scripts_to_download = []
+            logging.info("Step 3: Image downloading skipped, Cloudinary ingests the source URLs in step 4")
+        elif mode == 'incremental':
+            # Scripts needing image downloads, looked up by their unset flags
+            download_records = {record.key: record for record in data_update.script_records_needing('coverImageDownloaded', 'imageContentDownloaded')}
+            # Only the details of those scripts are kept, to get URLs
+            detailed_data = {row['scriptId']: row for row in data_update.read_details(script_ids=download_records)}
+            scripts_to_download = []
+            for script_id, record in download_records.items():
+                if script_id not in detailed_data:
+                    logging.debug(f"scriptId={script_id} needs download but has no details")
+                scripts_to_download.append({**record.to_row(), **detailed_data.get(script_id, {})})
+            del detailed_data
             logging.info(f"Step 3: Preparing to download images for {len(scripts_to_download)} scripts based on download flags")
         else:
-            scripts_to_download = new_details if new_details else data_update.read_csv(config.DETAILED_CSV_PATH)
+            scripts_to_download = data_update.read_details()
             logging.info(f"Step 3: Preparing to download images for {len(scripts_to_download)} scripts in full mode")
         
         if fetch_images and scripts_to_download:
-            downloaded_images, total_size = web_scraping.download_images_sync(scripts_to_download)
+            downloaded_images, total_size = await web_scraping.download_images(scripts_to_download, client=client)
             logging.info(f"Step 3: {downloaded_images} images downloaded, total size: {total_size:.2f} MB")
             data_update.update_script_details(scripts_to_download, mode=mode)
             data_update.update_script_list_flags(scripts_to_download)
-        else:
+        elif not remote_ingest:
             logging.info("Step 3: Image downloading skipped as per user request or no scripts to process.")
     else:
-        scripts_to_download = data_update.read_csv(config.SCRIPT_LIST_PATH)
-        logging.debug(f"Skipping Step 3, loaded {len(scripts_to_download)} scripts from SCRIPT_LIST_PATH")
+        scripts_to_download = [record.to_row() for record in data_update.read_script_records()]
+        logging.debug(f"Skipping Step 3, loaded {len(scripts_to_download)} scripts from {config.STATE_DB_PATH}")
 
     # Step 4: Upload images to Cloudinary and update details and script list flags
     if start_step <= 4:
         if upload_images:
-            existing_scripts = data_update.read_csv(config.SCRIPT_LIST_PATH)
-            scripts_to_upload = [
-                script for script in existing_scripts
-                if (script.get('coverImageDownloaded', 'False') == 'True' and script.get('coverImageUploaded', 'False') == 'False') or
-                   (script.get('imageContentDownloaded', 'False') == 'True' and script.get('imageContentUploaded', 'False') == 'False')
-            ]
-            script_ids_to_upload = {script['scriptId'] for script in scripts_to_upload}
+            not_uploaded = data_update.script_records_needing('coverImageUploaded', 'imageContentUploaded')
+            if remote_ingest:
+                # Nothing is downloaded in this mode, so every script without uploads is a candidate
+                scripts_to_upload = not_uploaded
+            else:
+                # Downloaded but not uploaded, as one mask test per image kind
+                cover_bits = records.flag_mask('coverImageDownloaded', 'coverImageUploaded')
+                content_bits = records.flag_mask('imageContentDownloaded', 'imageContentUploaded')
+                cover_ready = records.FLAG_BITS['coverImageDownloaded']
+                content_ready = records.FLAG_BITS['imageContentDownloaded']
+                scripts_to_upload = [
+                    record for record in not_uploaded
+                    if record.flags & cover_bits == cover_ready or record.flags & content_bits == content_ready
+                ]
+            script_ids_to_upload = {record.key for record in scripts_to_upload}
             scripts_to_download = [s for s in scripts_to_download if s['scriptId'] in script_ids_to_upload]
             logging.info(f"Step 4: Identified {len(scripts_to_upload)} scripts needing uploads based on upload flags")
 
             if scripts_to_upload:
-                cover_uploaded_count, cover_status = cloudinary_upload.upload_to_cloudinary(config.SCRIPT_COVER_FOLDER, "cover")
-                content_uploaded_count, content_status = cloudinary_upload.upload_to_cloudinary(config.SCRIPT_IMAGE_CONTENT_FOLDER, "content")
-                total_uploaded_count = cover_uploaded_count + content_uploaded_count
+                if remote_ingest:
+                    # Upload flags live on the script list, URLs on the detail rows
+                    upload_flags = {record.key: record for record in scripts_to_upload}
+                    scripts_to_download = [
+                        {**detail, 'coverImageUploaded': str(upload_flags[detail['scriptId']].has('coverImageUploaded')),
+                         'imageContentUploaded': str(upload_flags[detail['scriptId']].has('imageContentUploaded'))}
+                        for detail in data_update.read_details(script_ids=upload_flags)
+                    ]
+                    (cover_uploaded_count, cover_status), (content_uploaded_count, content_status) = await asyncio.gather(
+                        asyncio.to_thread(cloudinary_upload.ingest_remote, scripts_to_download, "cover"),
+                        asyncio.to_thread(cloudinary_upload.ingest_remote, scripts_to_download, "content")
+                    )
+                    total_uploaded_count = cover_uploaded_count + content_uploaded_count
+                else:
+                    # Images downloaded before the pending-upload queue existed are queued once from their detail rows
+                    unqueued = {
+                        kind: {
+                            record.key for record in scripts_to_upload
+                            if record.has(downloaded_key) and not record.has(uploaded_key)
+                        } - upload_queue.pending_script_ids(kind)
+                        for kind, downloaded_key, uploaded_key in (
+                            ("cover", 'coverImageDownloaded', 'coverImageUploaded'),
+                            ("content", 'imageContentDownloaded', 'imageContentUploaded')
+                        )
+                    }
+                    if any(unqueued.values()):
+                        upload_queue.enqueue(
+                            entry
+                            for detail in data_update.read_details(script_ids=set().union(*unqueued.values()))
+                            for kind, script_ids in unqueued.items() if detail['scriptId'] in script_ids
+                            for entry in web_scraping.rebuild_upload_entries(detail, kind)
+                        )
+
+                    # Each account uses its own credentials per call, so both run at the same time
+                    (cover_uploaded_count, cover_status), (content_uploaded_count, content_status) = await asyncio.gather(
+                        asyncio.to_thread(cloudinary_upload.upload_pending, "cover"),
+                        asyncio.to_thread(cloudinary_upload.upload_pending, "content")
+                    )
+                    total_uploaded_count = cover_uploaded_count + content_uploaded_count
                 
                 for script in scripts_to_download:
                     script_id = script['scriptId']
@@ -138,46 +220,29 @@ def main(mode='incremental', log_level='INFO', start_step=1, fetch_images=True,
     else:
         logging.debug("Skipping Step 4")
 
-    # Step 5: Translate the detailed CSV
+    # Step 5: Translate the detailed dataset
     if start_step <= 5:
-        data_processing.translate_csv(config.DETAILED_CSV_PATH, config.TRANSLATED_CSV_PATH)
+        data_processing.translate_details(config.DETAILED_CSV_PATH, config.TRANSLATED_CSV_PATH, rebuild=mode != 'incremental')
         logging.info("Step 5: Data translated")
-        translated_details = data_update.read_csv(config.TRANSLATED_CSV_PATH)
-        script_list_dict = {s['scriptId']: s for s in data_update.read_csv(config.SCRIPT_LIST_PATH)}
-        for detail in translated_details:
-            if detail['scriptId'] in script_list_dict:
-                detail.update({
-                    'coverImageDownloaded': script_list_dict[detail['scriptId']].get('coverImageDownloaded', 'False'),
-                    'imageContentDownloaded': script_list_dict[detail['scriptId']].get('imageContentDownloaded', 'False'),
-                    'coverImageUploaded': script_list_dict[detail['scriptId']].get('coverImageUploaded', 'False'),
-                    'imageContentUploaded': script_list_dict[detail['scriptId']].get('imageContentUploaded', 'False'),
-                    'databaseInserted': script_list_dict[detail['scriptId']].get('databaseInserted', 'False')
-                })
     else:
-        translated_details = data_update.read_csv(config.TRANSLATED_CSV_PATH) if os.path.exists(config.TRANSLATED_CSV_PATH) else []
-        script_list_dict = {s['scriptId']: s for s in data_update.read_csv(config.SCRIPT_LIST_PATH)}
-        for detail in translated_details:
-            if detail['scriptId'] in script_list_dict:
-                detail.update({
-                    'coverImageDownloaded': script_list_dict[detail['scriptId']].get('coverImageDownloaded', 'False'),
-                    'imageContentDownloaded': script_list_dict[detail['scriptId']].get('imageContentDownloaded', 'False'),
-                    'coverImageUploaded': script_list_dict[detail['scriptId']].get('coverImageUploaded', 'False'),
-                    'imageContentUploaded': script_list_dict[detail['scriptId']].get('imageContentUploaded', 'False'),
-                    'databaseInserted': script_list_dict[detail['scriptId']].get('databaseInserted', 'False')
-                })
-        logging.debug(f"Skipping Step 5, loaded {len(translated_details)} translated details")
+        logging.debug("Skipping Step 5")
+    # Only rows still waiting for import are loaded, with their current script list flags
+    pending_import = {record.key: record for record in data_update.script_records_needing('databaseInserted')}
+    translated_details = [
+        {**detail, **pending_import[detail['scriptId']].flag_row()}
+        for detail in data_update.read_details(config.TRANSLATED_CSV_PATH, script_ids=pending_import)
+    ]
+    del pending_import
+    logging.debug(f"Loaded {len(translated_details)} translated details pending import")
 
     # Step 6: Import into Prisma database
     if start_step <= 6:
-        if mode == 'full':
-            scripts_to_upsert = translated_details
-            logging.info(f"Step 6: Importing all {len(scripts_to_upsert)} scripts into Prisma database (full mode)")
-        else:
-            scripts_to_upsert = [script for script in translated_details if script.get('databaseInserted', 'False') == 'False']
-            logging.info(f"Step 6: Importing {len(scripts_to_upsert)} scripts with databaseInserted=False into Prisma database (incremental mode)")
+        # Unchanged scripts keep databaseInserted=True across full refreshes, so both modes import only dirty rows
+        scripts_to_upsert = [script for script in translated_details if script.get('databaseInserted', 'False') == 'False']
+        logging.info(f"Step 6: Importing {len(scripts_to_upsert)} scripts with databaseInserted=False into Prisma database ({mode} mode)")
 
         if scripts_to_upsert:
-            asyncio.run(prisma_operations.import_scripts_and_relations(scripts_to_upsert))
+            await prisma_operations.import_scripts_and_relations(scripts_to_upsert)
             for script in scripts_to_upsert:
                 script['databaseInserted'] = 'True'
             data_update.update_script_list_flags(scripts_to_upsert)
@@ -193,6 +258,8 @@ if __name__ == "__main__":
     log_level = 'INFO'  # Set to DEBUG for detailed logs
     fetch_images = True
     upload_images = True
+    remote_ingest = config.CLOUDINARY_REMOTE_INGEST  # True: Cloudinary fetches source URLs, nothing is downloaded
+    pipeline_mode = False  # True: stream each script through steps 2-6 instead of running them as phases
 
-    main(mode=mode, log_level=log_level, start_step=start_step, fetch_images=fetch_images, upload_images=upload_images)
+    main(mode=mode, log_level=log_level, start_step=start_step, fetch_images=fetch_images, upload_images=upload_images, remote_ingest=remote_ingest, pipeline_mode=pipeline_mode)
     logging.info(f"Cron job execution completed from step {start_step}")
\ No newline at end of file
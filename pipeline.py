@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import time
+import cloudinary_upload
+import config
+import data_processing
+import data_update
+import image_processing
+import image_store
+import prisma_operations
+import records
+import upload_queue
+import web_scraping
+
+# Script list flags carried on each script as it moves through the pipeline
+FLAG_FIELDS = records.FLAG_FIELDS
+
+# (account, downloaded flag, uploaded flag)
+UPLOAD_KINDS = (
+    ("cover", 'coverImageDownloaded', 'coverImageUploaded'),
+    ("content", 'imageContentDownloaded', 'imageContentUploaded'),
+)
+
+def resumable_script_ids(fetch_images=True, upload_images=True, remote_ingest=False):
+    """scriptIds left unfinished by earlier runs with an unfinished stage that is enabled and can still finish."""
+    downloads = fetch_images and not remote_ingest
+    unfinished = data_update.script_records_needing(*FLAG_FIELDS)
+    url_fields = tuple(cloudinary_upload.ACCOUNT_URL_FIELDS.values())
+    details = {}
+    if downloads or upload_images:
+        details = {row['scriptId']: row for row in data_update.read_details(columns=url_fields, script_ids={record.key for record in unfinished})}
+    # URLs that answered 404/410 stay unfinished for good, so they do not bring their script back
+    manifest = image_store.load_manifest() if downloads else {}
+
+    def can_finish(record):
+        if not record.has('databaseInserted'):
+            return True
+        detail = details.get(record.key, {})
+        for account_type, downloaded_key, uploaded_key in UPLOAD_KINDS:
+            urls = [url for url in detail.get(cloudinary_upload.ACCOUNT_URL_FIELDS[account_type], '').split('@') if url]
+            if not urls:
+                continue
+            downloadable = downloads and not any(manifest.get(url, {}).get('gone') for url in urls)
+            if not record.has(downloaded_key) and downloadable:
+                return True
+            if upload_images and not record.has(uploaded_key) and (remote_ingest or record.has(downloaded_key) or downloadable):
+                return True
+        return False
+
+    return [record.key for record in unfinished if can_finish(record)]
+
+class ScriptPipeline:
+    """Stream each script through fetch-detail, download, upload, translate and upsert on its own."""
+
+    def __init__(self, client, mode='incremental', fetch_images=True, upload_images=True, remote_ingest=False):
+        self.client = client
+        self.mode = mode
+        self.fetch_images = fetch_images
+        self.upload_images = upload_images
+        self.remote_ingest = remote_ingest
+        self.detail_url = config.HOST + config.PLAT_FORM_SCRIPT_INFO
+        self.script_list = {}
+        self.fingerprints = {}
+        self.changed_ids = set()
+        self.downloaded = []
+        self.downloaded_ids = set()
+        self.finished = []
+        self.started_at = {}
+        self.total = 0
+        self.journal = None
+        self.session = None
+        self.prisma = None
+        self.seq_no = 0
+        self.stats = {}
+        self.pending_uploads = {}
+        self.completed_uploads = {account_type: [] for account_type, _, _ in UPLOAD_KINDS}
+        self.flushed_at = 0.0
+
+    async def run(self, script_ids):
+        """Push script_ids through every stage and return the scripts that reached the last one."""
+        self.script_list = {record.key: record for record in data_update.read_script_records()}
+        self.fingerprints = {
+            row['scriptId']: row.get('contentFingerprint', '') for row in data_update.read_details(columns=('contentFingerprint',))
+        }
+        self.total = len(script_ids)
+        # The upload queues are read once per run and rewritten in batches (flush_completed_uploads)
+        self.pending_uploads = {account_type: {} for account_type, _, _ in UPLOAD_KINDS}
+        for account_type in self.pending_uploads:
+            for entry in upload_queue.load_pending(account_type).values():
+                self.pending_uploads[account_type].setdefault(entry['scriptId'], []).append(entry)
+        self.flushed_at = time.monotonic()
+        stages = [
+            ('detail', self.fetch_detail),
+            ('download', self.download),
+            ('upload', self.upload),
+            ('translate', self.translate),
+            ('upsert', self.upsert),
+        ]
+        queues = [asyncio.Queue(maxsize=config.PIPELINE_QUEUE_SIZE) for _ in stages]
+        workers = [config.PIPELINE_STAGE_WORKERS[name] for name, _ in stages]
+
+        manifest = image_store.load_manifest()
+        self.prisma = prisma_operations.PrismaOperations()
+        await self.prisma.connect()
+        try:
+            self.seq_no = await self.prisma.get_max_seq_no()
+            with data_update.open_journal(config.DETAIL_JOURNAL_PATH) as self.journal:
+                async with image_processing.ImageProcessingStage() as processor:
+                    self.session = web_scraping.ImageDownloadSession(self.client, processor, manifest)
+                    start = time.monotonic()
+                    await asyncio.gather(
+                        self._feed(script_ids, queues[0], workers[0]),
+                        *(
+                            self._run_stage(name, func, queues[i], queues[i + 1] if i + 1 < len(stages) else None,
+                                            workers[i], workers[i + 1] if i + 1 < len(stages) else 0)
+                            for i, (name, func) in enumerate(stages)
+                        )
+                    )
+                    self.log_stats(time.monotonic() - start)
+        finally:
+            self.flush_completed_uploads()
+            image_store.save_manifest(manifest)
+            await self.prisma.disconnect()
+        return self.finished
+
+    async def _feed(self, script_ids, queue, consumers):
+        for script_id in script_ids:
+            self.started_at[str(script_id)] = time.monotonic()
+            await queue.put(script_id)
+        for _ in range(consumers):
+            await queue.put(None)
+
+    async def _run_stage(self, name, func, inbox, outbox, workers, downstream_workers):
+        stats = self.stats.setdefault(name, {'processed': 0, 'failed': 0, 'busy_seconds': 0.0})
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is None:
+                    return
+                start = time.monotonic()
+                try:
+                    result = await func(item)
+                except Exception as e:
+                    logging.error(f"Pipeline stage {name} failed: {str(e)}")
+                    result = None
+                stats['busy_seconds'] += time.monotonic() - start
+                stats['processed'] += 1
+                if result is None:
+                    stats['failed'] += 1
+                elif outbox is not None:
+                    await outbox.put(result)
+                else:
+                    self.finished.append(result)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if outbox is not None:
+            for _ in range(downstream_workers):
+                await outbox.put(None)
+
+    async def fetch_detail(self, script_id):
+        index = self.stats['detail']['processed'] + 1
+        detail = await web_scraping.fetch_script_detail(self.client, self.detail_url, script_id, index, self.total)
+        if detail is None:
+            return None
+        data_update.append_journal(self.journal, detail)
+        script_id = str(script_id)
+        if detail.get('contentFingerprint') != self.fingerprints.get(script_id):
+            self.changed_ids.add(script_id)
+        record = self.script_list.get(script_id) or records.ScriptRecord(script_id)
+        # Later stages expect the string rows read back from the detailed dataset
+        return {**data_update.stored_row(detail), 'scriptId': script_id, **record.flag_row()}
+
+    async def download(self, script):
+        needs_download = any(str(script.get(flag)) != 'True' for _, flag, _ in UPLOAD_KINDS)
+        if self.fetch_images and not self.remote_ingest and needs_download:
+            await web_scraping.download_images([script], session=self.session)
+            self.downloaded.append(script)
+            self.downloaded_ids.add(script['scriptId'])
+        return script
+
+    async def upload(self, script):
+        if self.upload_images:
+            await asyncio.gather(*(self._upload_kind(script, *kind) for kind in UPLOAD_KINDS))
+        return script
+
+    async def _upload_kind(self, script, account_type, downloaded_key, uploaded_key):
+        script_id = script['scriptId']
+        if str(script.get(uploaded_key)) == 'True':
+            return
+        if self.remote_ingest:
+            _, status = await asyncio.to_thread(cloudinary_upload.ingest_remote, [script], account_type)
+        else:
+            if str(script.get(downloaded_key)) != 'True':
+                return
+            entries = self.pending_uploads[account_type].pop(script_id, [])
+            if not entries or script_id in self.downloaded_ids:
+                # Entries queued by this run's download stage are rebuilt from the script instead of reread
+                entries = web_scraping.rebuild_upload_entries(script, account_type)
+            completed, status = await asyncio.to_thread(cloudinary_upload.upload_entries, entries, account_type)
+            self.completed_uploads[account_type] += completed
+            if time.monotonic() - self.flushed_at >= config.PIPELINE_QUEUE_FLUSH_INTERVAL:
+                self.flush_completed_uploads()
+        if script_id in status:
+            script[uploaded_key] = status[script_id]
+
+    def flush_completed_uploads(self):
+        """Drop uploaded entries from the queue files, one rewrite per account, on the event loop thread."""
+        for account_type, completed in self.completed_uploads.items():
+            upload_queue.complete(account_type, completed)
+            completed.clear()
+        self.flushed_at = time.monotonic()
+
+    async def translate(self, script):
+        return script, await asyncio.to_thread(data_processing.translate_row, script)
+
+    async def upsert(self, item):
+        script, translated = item
+        script_id = script['scriptId']
+        if script.get('databaseInserted') == 'True' and script_id not in self.changed_ids:
+            return script
+        self.seq_no += 1
+        index = self.stats['upsert']['processed']
+        script['databaseInserted'] = await self.prisma.process_script(translated, self.seq_no, index, self.total)
+        if script['databaseInserted']:
+            latency = time.monotonic() - self.started_at[script_id]
+            self.stats['upsert'].setdefault('latencies', []).append(latency)
+        return script
+
+    def log_stats(self, elapsed):
+        for name, stats in self.stats.items():
+            logging.info(f"Pipeline stage {name}: {stats['processed']} scripts ({stats['failed']} failed), "
+                         f"busy {stats['busy_seconds']:.1f}s over {config.PIPELINE_STAGE_WORKERS[name]} workers")
+        latencies = self.stats.get('upsert', {}).get('latencies', [])
+        if latencies:
+            logging.info(f"Pipeline: {len(latencies)} scripts reached the database in {elapsed:.1f}s, "
+                         f"first after {min(latencies):.1f}s, average {sum(latencies) / len(latencies):.1f}s")
+
+async def run_pipeline(client, script_ids, mode='incremental', fetch_images=True, upload_images=True, remote_ingest=False):
+    """Run the streaming pipeline over script_ids, then persist details, flags and the translated dataset."""
+    pipeline = ScriptPipeline(client, mode, fetch_images, upload_images, remote_ingest)
+    finished = await pipeline.run(script_ids)
+
+    changed_ids = set()
+    data_update.update_script_details_from_journal(config.DETAIL_JOURNAL_PATH, mode=mode, changed_ids=changed_ids)
+    if pipeline.downloaded:
+        data_update.update_script_details(pipeline.downloaded, mode='incremental')
+    # Scripts dropped by a failed stage keep databaseInserted=False so the next run imports them
+    data_update.mark_scripts_dirty(changed_ids - {script['scriptId'] for script in finished})
+    data_update.set_script_list_flags({
+        script['scriptId']: {field: script[field] for field in FLAG_FIELDS} for script in finished
+    })
+    data_processing.translate_details(config.DETAILED_CSV_PATH, config.TRANSLATED_CSV_PATH, rebuild=mode != 'incremental')
+    logging.info(f"Pipeline: {len(finished)} of {len(script_ids)} scripts completed every stage")
+    return finished
@@ -16,6 +16,9 @@ logger = logging.getLogger(__name__)
 class PrismaOperations:
     def __init__(self):
         self.prisma = Prisma(auto_register=True)
+        # Dimension caches filled by import_relations: author name / issuer mqIssueUnitId -> id
+        self.author_ids = {}
+        self.issuer_ids = {}
 
     async def connect(self):
         await self.prisma.connect()
@@ -126,55 +129,96 @@ class PrismaOperations:
 
     async def upsert_issuers_and_authors(self, row: Dict[str, str]):
         """Upsert issuers and authors for a script based on row data."""
-        script_id = row['scriptId']
-        issue_info_items = row.get('scriptIssueInfoItems', '')
+        await self.import_relations([row])
 
-        if not issue_info_items or issue_info_items.strip() == '':
+    async def import_relations(self, rows: List[Dict[str, str]]):
+        """Link scripts to their authors and issuers in bulk."""
+        relations = {}
+        for row in rows:
+            try:
+                authors, issuers = parse_issue_items(row.get('scriptIssueInfoItems', ''))
+            except Exception as e:
+                logger.error(f"Error parsing issue items for scriptId {row['scriptId']}: {e}")
+                continue
+            if authors or issuers:
+                relations[row['scriptId']] = (authors, issuers)
+        if not relations:
             return
 
-        issue_items = [item.strip() for item in issue_info_items.split(',')]
-        script = await self.prisma.larpscript.find_unique(where={'mqScriptId': script_id})
-        if not script:
-            return
+        script_ids = {}
+        for chunk in _chunks(list(relations), config.RELATION_IMPORT_CHUNK_SIZE):
+            scripts = await self.prisma.larpscript.find_many(where={'mqScriptId': {'in': chunk}})
+            script_ids.update({script.mqScriptId: script.id for script in scripts})
 
-        for item in issue_items:
-            try:
-                name, id_bracket = item.split(' ', 1) if ' ' in item else (item, 'None')
-                unit_id = id_bracket.replace('(', '').replace(')', '')
-
-                if unit_id == 'None':
-                    authors = [a.strip() for a in name.split('&')]
-                    for author in authors:
-                        author_record = await self.prisma.larpscriptauthor.upsert(
-                            where={'name': author},
-                            data={'create': {'name': author}, 'update': {}}
-                        )
-                        await self.prisma.larpscriptswrittenbyauthors.upsert(
-                            where={'scriptId_authorId': {'scriptId': script.id, 'authorId': author_record.id}},
-                            data={'create': {'scriptId': script.id, 'authorId': author_record.id}, 'update': {}}
-                        )
-                else:
-                    issuer_record = await self.prisma.larpscriptissuer.upsert(
-                        where={'mqIssueUnitId': unit_id},
-                        data={'create': {'mqIssueUnitId': unit_id, 'name': name, 'intro': ''}, 'update': {}}
-                    )
-                    await self.prisma.larpscriptsissuedbyissuers.upsert(
-                        where={'scriptId_issuerId': {'scriptId': script.id, 'issuerId': issuer_record.id}},
-                        data={'create': {'scriptId': script.id, 'issuerId': issuer_record.id}, 'update': {}}
-                    )
-            except Exception as e:
-                logger.error(f"Error processing issue item '{item}' for scriptId {script_id}: {e}")
+        author_names = {author for script_id, (authors, _) in relations.items() if script_id in script_ids for author in authors}
+        issuer_names = {}
+        for script_id, (_, issuers) in relations.items():
+            if script_id in script_ids:
+                for unit_id, name in issuers.items():
+                    issuer_names.setdefault(unit_id, name)
+        await self._load_dimension(self.prisma.larpscriptauthor, 'name', author_names, self.author_ids,
+                                   lambda name: {'name': name})
+        await self._load_dimension(self.prisma.larpscriptissuer, 'mqIssueUnitId', set(issuer_names), self.issuer_ids,
+                                   lambda unit_id: {'mqIssueUnitId': unit_id, 'name': issuer_names[unit_id], 'intro': ''})
+
+        written_by = []
+        issued_by = []
+        for script_id, (authors, issuers) in relations.items():
+            if script_id not in script_ids:
+                continue
+            written_by += [{'scriptId': script_ids[script_id], 'authorId': self.author_ids[author]}
+                           for author in authors if author in self.author_ids]
+            issued_by += [{'scriptId': script_ids[script_id], 'issuerId': self.issuer_ids[unit_id]}
+                          for unit_id in issuers if unit_id in self.issuer_ids]
+        for model, data in ((self.prisma.larpscriptswrittenbyauthors, written_by), (self.prisma.larpscriptsissuedbyissuers, issued_by)):
+            for chunk in _chunks(data, config.RELATION_IMPORT_CHUNK_SIZE):
+                await model.create_many(data=chunk, skip_duplicates=True)
+        logger.info(f"Linked {len(script_ids)} scripts to {len(author_names)} authors and {len(issuer_names)} issuers "
+                    f"({len(written_by)} author and {len(issued_by)} issuer links)")
+
+    async def _load_dimension(self, model, key_field: str, keys, cache: Dict[str, str], create_data):
+        """Fill cache with key -> id for keys, creating the records that do not exist yet."""
+        missing = [key for key in keys if key not in cache]
+        for chunk in _chunks(missing, config.RELATION_IMPORT_CHUNK_SIZE):
+            existing = await model.find_many(where={key_field: {'in': chunk}})
+            cache.update({getattr(record, key_field): record.id for record in existing})
+        new_keys = [key for key in missing if key not in cache]
+        for chunk in _chunks(new_keys, config.RELATION_IMPORT_CHUNK_SIZE):
+            await model.create_many(data=[create_data(key) for key in chunk], skip_duplicates=True)
+            created = await model.find_many(where={key_field: {'in': chunk}})
+            cache.update({getattr(record, key_field): record.id for record in created})
 
-    async def process_script(self, row: Dict[str, str], seq_no: int, index: int, total: int):
-        """Process a single script with logging."""
+    async def process_script(self, row: Dict[str, str], seq_no: int, index: int, total: int, relations: bool = True):
+        """Process a single script with logging; relations=False leaves authors and issuers to import_relations."""
         script_id = row['scriptId']
         script_name = row['scriptName']
         logger.info(f"{index + 1}/{total}: {script_id} {script_name}")
         success = await self.upsert_larp_script(row, seq_no)
-        if success:
+        if success and relations:
             await self.upsert_issuers_and_authors(row)
         return success
 
+def parse_issue_items(issue_info_items: str):
+    """Split scriptIssueInfoItems into author names and {mqIssueUnitId: issuer name}."""
+    authors = []
+    issuers = {}
+    if not issue_info_items or issue_info_items.strip() == '':
+        return authors, issuers
+    for item in (item.strip() for item in issue_info_items.split(',')):
+        name, id_bracket = item.split(' ', 1) if ' ' in item else (item, 'None')
+        unit_id = id_bracket.replace('(', '').replace(')', '')
+        if unit_id == 'None':
+            for author in (author.strip() for author in name.split('&')):
+                if author and author not in authors:
+                    authors.append(author)
+        else:
+            issuers.setdefault(unit_id, name)
+    return authors, issuers
+
+def _chunks(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
 async def import_scripts_and_relations(new_details: List[Dict[str, str]], max_concurrency: int = 50):
     """Import scripts and their issuers/authors into Prisma database in parallel."""
     prisma_ops = PrismaOperations()
@@ -193,7 +237,7 @@ async def import_scripts_and_relations(new_details: List[Dict[str, str]], max_co
 
     async def sem_task(row, seq_no, index):
         async with semaphore:
-            return await prisma_ops.process_script(row, seq_no, index, total_rows)
+            return await prisma_ops.process_script(row, seq_no, index, total_rows, relations=False)
 
     # Create tasks for all rows
     tasks = [
@@ -207,6 +251,12 @@ async def import_scripts_and_relations(new_details: List[Dict[str, str]], max_co
     upsert_count = sum(1 for result in results if result is True)
     failed_count = total_rows - upsert_count
 
+    # Authors and issuers of every upserted script in one bulk phase
+    try:
+        await prisma_ops.import_relations([row for row, result in zip(new_details, results) if result is True])
+    except Exception as e:
+        logger.error(f"Error importing authors and issuers: {e}")
+
     logger.info(f"Success: {upsert_count} rows upserted.")
     logger.info(f"Failed: {failed_count} rows.")
 
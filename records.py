@@ -0,0 +1,64 @@
+# Pipeline flags of a script list row, in bit order
+FLAG_FIELDS = ('coverImageDownloaded', 'imageContentDownloaded', 'coverImageUploaded', 'imageContentUploaded', 'databaseInserted')
+FLAG_BITS = {field: 1 << bit for bit, field in enumerate(FLAG_FIELDS)}
+
+def flag_mask(*fields):
+    """Bit mask covering the given flag fields."""
+    mask = 0
+    for field in fields:
+        mask |= FLAG_BITS[field]
+    return mask
+
+class ScriptRecord:
+    """Script list entry: scriptId (an int when numeric) and the pipeline flags packed in one int."""
+
+    __slots__ = ('script_id', 'script_name', 'first_fetch_at', 'last_modified_at', 'flags')
+
+    def __init__(self, script_id, script_name='', first_fetch_at=None, last_modified_at=None, flags=0):
+        script_id = str(script_id)
+        self.script_id = int(script_id) if script_id.isdigit() else script_id
+        self.script_name = script_name or ''
+        self.first_fetch_at = first_fetch_at
+        self.last_modified_at = last_modified_at
+        self.flags = flags
+
+    @classmethod
+    def from_row(cls, row):
+        flags = 0
+        for field, bit in FLAG_BITS.items():
+            if str(row.get(field, False)) == 'True':
+                flags |= bit
+        return cls(row['scriptId'], row.get('scriptName', ''), row.get('firstFetchAt') or None, row.get('lastModifiedAt') or None, flags)
+
+    @property
+    def key(self):
+        """scriptId as the string used by CSV rows and API payloads."""
+        return str(self.script_id)
+
+    def has(self, field):
+        return bool(self.flags & FLAG_BITS[field])
+
+    def has_all(self, mask):
+        return self.flags & mask == mask
+
+    def set_flag(self, field, value):
+        if str(value) == 'True':
+            self.flags |= FLAG_BITS[field]
+        else:
+            self.flags &= ~FLAG_BITS[field]
+
+    def flag_row(self):
+        """The flags as SCRIPT_LIST_PATH strings."""
+        return {field: 'True' if self.flags & bit else 'False' for field, bit in FLAG_BITS.items()}
+
+    def to_row(self):
+        return {
+            'scriptId': self.key,
+            'scriptName': self.script_name,
+            'firstFetchAt': '' if self.first_fetch_at is None else str(self.first_fetch_at),
+            'lastModifiedAt': '' if self.last_modified_at is None else str(self.last_modified_at),
+            **self.flag_row(),
+        }
+
+    def __repr__(self):
+        return f"ScriptRecord({self.script_id}, flags={self.flags:05b})"
@@ -0,0 +1,185 @@
+import csv
+import logging
+import os
+import sqlite3
+import config
+from records import FLAG_BITS, FLAG_FIELDS, ScriptRecord
+
+# Columns of SCRIPT_LIST_PATH, in export order
+SCRIPT_LIST_FIELDS = ['scriptId', 'scriptName', 'firstFetchAt', 'lastModifiedAt', *FLAG_FIELDS]
+# Record columns with the flag columns packed into ScriptRecord's bitfield by SQLite
+RECORD_COLUMNS = "scriptId, scriptName, firstFetchAt, lastModifiedAt, " + " | ".join(
+    f"({field} * {bit})" for field, bit in FLAG_BITS.items()
+)
+
+def _flag(value):
+    """Store a flag given as bool or 'True'/'False' string as 1/0."""
+    return 1 if str(value) == 'True' else 0
+
+def script_id_key(script_id):
+    """Sort key for scriptIds: numeric ids by value, any others after them."""
+    return (0, int(script_id), '') if script_id.isdigit() else (1, 0, script_id)
+
+class StateStore:
+    """SQLite-backed script list: one row per scriptId with indexed pipeline flags."""
+
+    def __init__(self, path=None):
+        self.path = path or config.STATE_DB_PATH
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        flag_columns = ', '.join(f"{field} INTEGER NOT NULL DEFAULT 0" for field in FLAG_FIELDS)
+        with self.connection:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS scripts (scriptId TEXT PRIMARY KEY, scriptName TEXT, "
+                f"firstFetchAt INTEGER, lastModifiedAt INTEGER, {flag_columns})"
+            )
+            for field in FLAG_FIELDS:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS idx_scripts_{field}_unset ON scripts(scriptId) WHERE {field} = 0")
+
+    def close(self):
+        self.connection.close()
+
+    def _to_row(self, record):
+        row = {key: '' if record[key] is None else str(record[key]) for key in ('scriptId', 'scriptName', 'firstFetchAt', 'lastModifiedAt')}
+        row.update({field: str(bool(record[field])) for field in FLAG_FIELDS})
+        return row
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM scripts").fetchone()[0]
+
+    def rows(self):
+        """Every script, ordered by scriptId like the CSV."""
+        rows = [self._to_row(record) for record in self.connection.execute("SELECT * FROM scripts")]
+        rows.sort(key=lambda row: script_id_key(row['scriptId']))
+        return rows
+
+    def ids(self):
+        return {record[0] for record in self.connection.execute("SELECT scriptId FROM scripts")}
+
+    def needing(self, *fields):
+        """Scripts with any of the given flags unset, found through the flags' partial indexes."""
+        query = " UNION ".join(f"SELECT scriptId FROM scripts WHERE {field} = 0" for field in fields)
+        ids = [record[0] for record in self.connection.execute(query)]
+        return self.get_many(ids)
+
+    def records(self):
+        """Every script as a ScriptRecord, ordered by scriptId."""
+        return self._records(f"SELECT {RECORD_COLUMNS} FROM scripts")
+
+    def records_needing(self, *fields):
+        """ScriptRecords with any of the given flags unset, found through the flags' partial indexes."""
+        unset = " UNION ".join(f"SELECT scriptId FROM scripts WHERE {field} = 0" for field in fields)
+        return self._records(f"SELECT {RECORD_COLUMNS} FROM scripts WHERE scriptId IN ({unset})")
+
+    def _records(self, query):
+        records = [ScriptRecord(*values) for values in self.connection.execute(query)]
+        records.sort(key=lambda record: script_id_key(record.key))
+        return records
+
+    def get_many(self, script_ids):
+        """Rows for the given scriptIds, skipping unknown ones."""
+        rows = []
+        for script_id in script_ids:
+            record = self.connection.execute("SELECT * FROM scripts WHERE scriptId = ?", (str(script_id),)).fetchone()
+            if record is not None:
+                rows.append(self._to_row(record))
+        rows.sort(key=lambda row: script_id_key(row['scriptId']))
+        return rows
+
+    def insert_new(self, rows):
+        """Insert scripts not stored yet and refresh the names of known ones; returns the number inserted."""
+        with self.connection:
+            inserted = self.connection.executemany(
+                f"INSERT OR IGNORE INTO scripts ({', '.join(SCRIPT_LIST_FIELDS)}) VALUES ({', '.join('?' * len(SCRIPT_LIST_FIELDS))})",
+                (self._values(row) for row in rows)
+            ).rowcount
+            self.connection.executemany(
+                "UPDATE scripts SET scriptName = ? WHERE scriptId = ? AND scriptName IS NOT ?",
+                ((row.get('scriptName', ''), str(row['scriptId']), row.get('scriptName', '')) for row in rows)
+            )
+        return inserted
+
+    def replace_all(self, rows, keep_fields=('databaseInserted',)):
+        """Replace the script list with rows, carrying keep_fields over from scripts already stored."""
+        kept = {
+            record['scriptId']: {field: record[field] for field in keep_fields}
+            for record in self.connection.execute(f"SELECT {', '.join(('scriptId',) + tuple(keep_fields))} FROM scripts")
+        }
+        with self.connection:
+            self.connection.execute("DELETE FROM scripts")
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO scripts ({', '.join(SCRIPT_LIST_FIELDS)}) VALUES ({', '.join('?' * len(SCRIPT_LIST_FIELDS))})",
+                (self._values(row, kept.get(str(row['scriptId']), {})) for row in rows)
+            )
+
+    def _values(self, row, overrides=None):
+        overrides = overrides or {}
+        values = [str(row['scriptId']), row.get('scriptName', ''), row.get('firstFetchAt') or None, row.get('lastModifiedAt') or None]
+        values += [overrides[field] if field in overrides else _flag(row.get(field, False)) for field in FLAG_FIELDS]
+        return values
+
+    def set_flags(self, flags, only_set=False):
+        """Apply {scriptId: {field: value}}; with only_set a True flag is never cleared."""
+        changed = 0
+        with self.connection:
+            for script_id, fields in flags.items():
+                fields = {field: _flag(value) for field, value in fields.items() if field in FLAG_FIELDS}
+                if not fields:
+                    continue
+                values = list(fields.values())
+                if only_set:
+                    assignments = ', '.join(f"{field} = MAX({field}, ?)" for field in fields)
+                    condition = ' OR '.join(f"({field} = 0 AND ? = 1)" for field in fields)
+                else:
+                    assignments = ', '.join(f"{field} = ?" for field in fields)
+                    condition = ' OR '.join(f"{field} != ?" for field in fields)
+                changed += self.connection.execute(
+                    f"UPDATE scripts SET {assignments} WHERE scriptId = ? AND ({condition})",
+                    values + [str(script_id)] + values
+                ).rowcount
+        return changed
+
+    def clear_flag(self, field, script_ids):
+        """Unset one flag for the given scripts; returns the number of rows changed."""
+        if field not in FLAG_FIELDS:
+            raise ValueError(f"Unknown flag {field}")
+        with self.connection:
+            return self.connection.executemany(
+                f"UPDATE scripts SET {field} = 0 WHERE scriptId = ? AND {field} = 1",
+                ((str(script_id),) for script_id in script_ids)
+            ).rowcount
+
+    def import_csv(self, file_path):
+        """Load a SCRIPT_LIST_PATH CSV, replacing the stored script list."""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.replace_all(rows, keep_fields=())
+        logging.info(f"Imported {len(rows)} scripts from {file_path} into {self.path}")
+
+    def export_csv(self, file_path):
+        """Write the script list as a SCRIPT_LIST_PATH-compatible CSV, sorted by scriptId."""
+        rows = self.rows()
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        temp_path = f"{file_path}.part"
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=SCRIPT_LIST_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(temp_path, file_path)
+        logging.info(f"Exported {len(rows)} scripts from {self.path} to {file_path}")
+
+_store = None
+
+def get_store():
+    """The process-wide store, created on first use and seeded from SCRIPT_LIST_PATH when empty."""
+    global _store
+    if _store is None:
+        _store = StateStore()
+        if _store.count() == 0 and os.path.exists(config.SCRIPT_LIST_PATH):
+            _store.import_csv(config.SCRIPT_LIST_PATH)
+    return _store
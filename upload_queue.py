@@ -0,0 +1,69 @@
+import logging
+import os
+import config
+import data_update
+import image_processing
+
+def public_id_for(account_type, script_id, url):
+    """Cloudinary public_id of an original image: the scriptId for covers, scriptId_<file name> for content."""
+    if account_type == "cover":
+        return f"{script_id}"
+    original_filename = os.path.splitext(url.split('/')[-1])[0]
+    return f"{script_id}_{original_filename}"
+
+def build_entry(account_type, script_id, url, path, sha256):
+    """Pending-upload record for one downloaded image."""
+    return {
+        'scriptId': str(script_id),
+        'account': account_type,
+        'url': url,
+        'path': path,
+        'publicId': public_id_for(account_type, script_id, url),
+        'sha256': sha256,
+    }
+
+def build_derivative_entries(account_type, script_id, url, sha256):
+    """Pending-upload records for the rendered derivatives of one downloaded image, as <publicId>_<width>w_<format>."""
+    entry = build_entry(account_type, script_id, url, '', '')
+    # No sha256, so copies are grouped by the derivative's content-addressed path instead
+    return [
+        {**entry, 'path': path, 'publicId': f"{entry['publicId']}_{width}w_{image_format.lower()}"}
+        for width, image_format, path in image_processing.planned_derivatives(sha256)
+        if os.path.exists(path)
+    ]
+
+def enqueue(entries):
+    """Append pending-upload entries to their account's queue file."""
+    journals = {}
+    try:
+        for entry in entries:
+            account_type = entry['account']
+            if account_type not in journals:
+                journals[account_type] = data_update.open_journal(config.PENDING_UPLOAD_PATHS[account_type])
+            data_update.append_journal(journals[account_type], entry)
+    finally:
+        for journal in journals.values():
+            journal.close()
+
+def load_pending(account_type):
+    """Return the account's pending uploads keyed by publicId; a later entry replaces an earlier one."""
+    return {entry['publicId']: entry for entry in data_update.iter_journal(config.PENDING_UPLOAD_PATHS[account_type])}
+
+def pending_script_ids(account_type):
+    """scriptIds with at least one image waiting to be uploaded to the account."""
+    return {entry['scriptId'] for entry in load_pending(account_type).values()}
+
+def complete(account_type, public_ids):
+    """Drop uploaded entries from the account's queue; failed ones stay for the next run."""
+    done = set(public_ids)
+    if not done:
+        return
+    queue_path = config.PENDING_UPLOAD_PATHS[account_type]
+    os.makedirs(os.path.dirname(queue_path), exist_ok=True)
+    remaining = [entry for public_id, entry in load_pending(account_type).items() if public_id not in done]
+    temp_path = f"{queue_path}.part"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for entry in remaining:
+            data_update.append_journal(f, entry)
+    os.replace(temp_path, queue_path)
+    logging.debug(f"Pending {account_type} uploads: {len(done)} completed, {len(remaining)} remaining")
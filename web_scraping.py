@@ -1,24 +1,25 @@
 import asyncio
-import aiohttp
 import config
+import data_update
+import http_client
+import image_processing
+import image_store
+import upload_queue
 import hashlib
 import json
 import random
 import os
 import time
-from PIL import Image
 import logging
 from io import BytesIO
+from urllib.parse import urlsplit
 
 # Configuration
 HOST = config.HOST
 SCRIPT_SEARCH_PAGE = config.SCRIPT_SEARCH_PAGE
 PLAT_FORM_SCRIPT_INFO = config.PLAT_FORM_SCRIPT_INFO
-REQUEST_TIMEOUT = config.REQUEST_TIMEOUT
-TIMEOUT_RETRY_LIMIT = config.TIMEOUT_RETRY_LIMIT
 SCRIPT_COVER_FOLDER = config.SCRIPT_COVER_FOLDER
 SCRIPT_IMAGE_CONTENT_FOLDER = config.SCRIPT_IMAGE_CONTENT_FOLDER
-COMPRESSION_THRESHOLD = config.COMPRESSION_THRESHOLD
 USER_AGENT = config.USER_AGENT
 
 # Headers from the working example
@@ -44,7 +45,12 @@ def serialize_data(data):
             serialized_str += f"{key}={data[key]}&"
     return serialized_str[:-1]
 
-async def fetch_page(session, url, payload, page_num):
+def payload_fingerprint(data):
+    """Stable SHA-256 over a normalized (key-sorted, compact) JSON rendering of an API payload."""
+    normalized = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+async def fetch_page(client, url, payload, page_num):
     """Fetch a single page asynchronously with retries."""
     random_float = random.uniform(0, 1)
     nonce = f"{random_float:.16f}"
@@ -55,34 +61,173 @@ async def fetch_page(session, url, payload, page_num):
     headers = HEADERS_TEMPLATE.copy()
     headers.update({"Checksum": checksum, "Nonce": nonce})
 
-    for attempt in range(TIMEOUT_RETRY_LIMIT):
+    async def handle(response):
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').lower()
+        if 'application/json' not in content_type:
+            logging.error(f"Unexpected content type for pageNum={page_num}: {content_type}")
+            return None
+
+        data = await response.json()
+        if not isinstance(data, dict) or 'head' not in data or data['head'].get('code') != 200:
+            if isinstance(data, dict) and data.get('head', {}).get('code') == 500 and data.get('data') is None:
+                logging.info(f"Server returned 500 with null data for pageNum={page_num}, treating as end of pagination")
+                return []  # Treat specific 500 error with null data as end of list
+            logging.warning(f"Server error for pageNum={page_num}: {json.dumps(data, ensure_ascii=False)}")
+            return None
+
+        return data.get('data', {}).get('items', [])
+
+    return await client.call('POST', url, handle, f"script list page {page_num}", json=payload, headers=headers)
+
+class AdaptiveConcurrency:
+    """AIMD limiter for in-flight requests driven by observed latency and error rate."""
+
+    def __init__(self, initial, minimum, maximum, target_latency, max_error_rate, decrease_factor=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.peak_limit = self.limit
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency, success):
+        async with self._condition:
+            self.in_flight -= 1
+            self.error_rate = 0.9 * self.error_rate + (0.0 if success else 0.1)
+            now = time.monotonic()
+            if not success or latency > self.target_latency or self.error_rate > self.max_error_rate:
+                # Back off at most once per latency window so one slow burst does not collapse the limit
+                if now - self._last_decrease >= self.target_latency:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logging.debug(f"Concurrency decreased to {self.limit:.1f} (latency={latency:.2f}s, error_rate={self.error_rate:.2f})")
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+            self._condition.notify_all()
+
+    async def submit(self, func, *args):
+        """Run func(*args) inside a slot; a None result counts as an error."""
+        await self.acquire()
+        start = time.monotonic()
+        result = None
         try:
-            logging.info(f"Fetching script list page {page_num}, attempt {attempt+1}")
-            async with session.post(url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as response:
-                response.raise_for_status()
-                content_type = response.headers.get('Content-Type', '').lower()
-                if 'application/json' not in content_type:
-                    logging.error(f"Unexpected content type for pageNum={page_num}: {content_type}")
-                    return None
-
-                data = await response.json()
-                if not isinstance(data, dict) or 'head' not in data or data['head'].get('code') != 200:
-                    if isinstance(data, dict) and data.get('head', {}).get('code') == 500 and data.get('data') is None:
-                        logging.info(f"Server returned 500 with null data for pageNum={page_num}, treating as end of pagination")
-                        return []  # Treat specific 500 error with null data as end of list
-                    logging.warning(f"Server error for pageNum={page_num}: {json.dumps(data, ensure_ascii=False)}")
-                    return None
-
-                return data.get('data', {}).get('items', [])
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logging.warning(f"Attempt {attempt+1} failed for pageNum={page_num}: {str(e)}")
-            if attempt == TIMEOUT_RETRY_LIMIT - 1:
-                logging.error(f"Failed after {TIMEOUT_RETRY_LIMIT} retries for pageNum={page_num}: {str(e)}")
-                return None
-            await asyncio.sleep(2 ** attempt)  # Backoff before retry
-
-async def fetch_script_list():
-    """Fetch script list with pagination asynchronously in batches of 50 pages."""
+            result = await func(*args)
+            return result
+        finally:
+            await self.release(time.monotonic() - start, result is not None)
+
+def build_page_payload(base_payload, page_num):
+    """Build the scriptSearchPage payload for a given page."""
+    payload = base_payload.copy()
+    payload['pageNum'] = page_num
+    payload['curShowSize'] = page_num * base_payload['pageSize']
+    return payload
+
+def build_script_entry(item, current_time):
+    """Convert a scriptSearchPage item into a SCRIPT_LIST_PATH row, or None without a scriptId."""
+    script_id = str(item.get('scriptId', ''))
+    if not script_id:
+        return None
+    return {
+        'scriptId': script_id,
+        'scriptName': item.get('scriptName', ''),
+        'firstFetchAt': current_time,
+        'lastModifiedAt': current_time,
+        'coverImageDownloaded': False,
+        'imageContentDownloaded': False,
+        'coverImageUploaded': False,
+        'imageContentUploaded': False,
+        'databaseInserted': False
+    }
+
+class ListCrawlError(Exception):
+    """Raised when the script list cannot be paged reliably, so the list is left as it is."""
+
+async def find_last_page(client, url, base_payload, fetched_pages):
+    """Find the last non-empty page, up to LIST_MAX_PAGE, with an exponential probe and a binary search."""
+    async def has_items(page_num):
+        for attempt in range(config.LIST_PROBE_RETRIES):
+            items = await fetch_page(client, url, build_page_payload(base_payload, page_num), page_num)
+            if items is not None:
+                fetched_pages[page_num] = items
+                return len(items) > 0
+            # Also waits out an open circuit, which fails without awaiting anything
+            await asyncio.sleep(http_client.backoff_delay(attempt))
+        raise ListCrawlError(f"Probe of pageNum={page_num} failed {config.LIST_PROBE_RETRIES} times")
+
+    max_page = config.LIST_MAX_PAGE
+    low, high = 0, 1
+    while high <= max_page and await has_items(high):
+        low, high = high, high * 2
+    high = min(high, max_page + 1)
+    while high - low > 1:
+        mid = (low + high) // 2
+        if await has_items(mid):
+            low = mid
+        else:
+            high = mid
+    if low == max_page:
+        logging.warning(f"Probe reached LIST_MAX_PAGE={max_page}; later pages are not crawled")
+    logging.info(f"Probe located last page at pageNum={low} using {len(fetched_pages)} requests")
+    return low
+
+async def fetch_script_list_delta(client, url, base_payload, known_ids):
+    """Page the newest-first listing until enough consecutive pages hold only known scriptIds (raises ListCrawlError on repeated failures)."""
+    payload_base = {**base_payload, **config.DELTA_LIST_PAYLOAD_OVERRIDES}
+    stop_after = config.DELTA_LIST_KNOWN_PAGE_LIMIT
+    current_time = int(time.time())
+    all_data = []
+    consecutive_known = 0
+    consecutive_failed = 0
+    page_offset = 0
+    while page_offset <= config.LIST_MAX_PAGE:
+        pages = range(page_offset, min(page_offset + stop_after, config.LIST_MAX_PAGE + 1))
+        results = await asyncio.gather(
+            *(fetch_page(client, url, build_page_payload(payload_base, page), page) for page in pages),
+            return_exceptions=True
+        )
+        for page_num, result in zip(pages, results):
+            if not isinstance(result, list):
+                # An unreadable page might hide new scripts, so it never counts towards the watermark
+                logging.warning(f"Page {page_num} failed during delta crawl: {result}")
+                consecutive_known = 0
+                consecutive_failed += 1
+                if consecutive_failed >= config.DELTA_LIST_MAX_FAILED_PAGES:
+                    raise ListCrawlError(f"{consecutive_failed} consecutive pages failed up to pageNum={page_num}")
+                continue
+            consecutive_failed = 0
+            if not result:
+                logging.info(f"Delta crawl reached end of pagination at pageNum={page_num}")
+                return all_data
+            entries = [entry for entry in (build_script_entry(item, current_time) for item in result) if entry]
+            all_data.extend(entries)
+            if any(entry['scriptId'] not in known_ids for entry in entries):
+                consecutive_known = 0
+            else:
+                consecutive_known += 1
+            if consecutive_known >= stop_after:
+                new_count = sum(1 for entry in all_data if entry['scriptId'] not in known_ids)
+                logging.info(f"Delta crawl hit known-ID watermark at pageNum={page_num}: "
+                             f"{new_count} new scripts in {page_num + 1} pages")
+                return all_data
+        page_offset += stop_after
+    logging.warning(f"Delta crawl reached LIST_MAX_PAGE={config.LIST_MAX_PAGE} without hitting the known-ID watermark")
+    return all_data
+
+async def fetch_script_list(known_ids=None, client=None):
+    """Fetch the script list, as a delta crawl up to the known IDs when known_ids is given."""
     url = HOST + SCRIPT_SEARCH_PAGE
     base_payload = {
         'scriptPlotTagType': '0', 'scriptLabelType': '0', 'pageNum': 0,
@@ -93,87 +238,57 @@ async def fetch_script_list():
         'curShowSize': 0, 'pageSize': 20
     }
     
-    async with aiohttp.ClientSession() as session:
+    async with http_client.borrow(client) as client:
+        if known_ids is not None:
+            return await fetch_script_list_delta(client, url, base_payload, known_ids)
+
         # Fetch page 0 to initialize
-        initial_payload = base_payload.copy()
-        initial_items = await fetch_page(session, url, initial_payload, 0)
+        initial_items = await fetch_page(client, url, build_page_payload(base_payload, 0), 0)
         if not initial_items:
             logging.info("No items found on page 0, returning empty list")
             return []
 
+        fetched_pages = {0: initial_items}
+        last_page = await find_last_page(client, url, base_payload, fetched_pages)
+
+        controller = AdaptiveConcurrency(
+            config.LIST_INITIAL_CONCURRENCY, config.LIST_MIN_CONCURRENCY, config.LIST_MAX_CONCURRENCY,
+            config.LIST_TARGET_LATENCY, config.LIST_MAX_ERROR_RATE
+        )
+        remaining = [page for page in range(1, last_page + 1) if page not in fetched_pages]
+        logging.debug(f"Fetching {len(remaining)} remaining pages up to pageNum={last_page}")
+        results = await asyncio.gather(
+            *(controller.submit(fetch_page, client, url, build_page_payload(base_payload, page), page) for page in remaining),
+            return_exceptions=True
+        )
+        fetched_pages.update(zip(remaining, results))
+
+        # The listing may have grown since the probe; keep going while the last page is full
+        page_num = last_page
+        while (page_num < config.LIST_MAX_PAGE and isinstance(fetched_pages.get(page_num), list)
+               and len(fetched_pages[page_num]) >= base_payload['pageSize']):
+            page_num += 1
+            fetched_pages[page_num] = await fetch_page(client, url, build_page_payload(base_payload, page_num), page_num)
+
         all_data = []
         current_time = int(time.time())
-        for item in initial_items:
-            script_id = str(item.get('scriptId', ''))
-            script_name = item.get('scriptName', '')
-            if script_id:
-                all_data.append({
-                    'scriptId': script_id,
-                    'scriptName': script_name,
-                    'firstFetchAt': current_time,
-                    'lastModifiedAt': current_time,
-                    'coverImageDownloaded': False,
-                    'imageContentDownloaded': False,
-                    'coverImageUploaded': False,
-                    'imageContentUploaded': False,
-                    'databaseInserted': False  # New flag
-                })
-
-        # Fetch pages in batches of 50
-        batch_size = 50
-        page_offset = 1
-        while True:
-            tasks = []
-            for page in range(page_offset, page_offset + batch_size):
-                payload = base_payload.copy()
-                payload['pageNum'] = page
-                payload['curShowSize'] = page * base_payload['pageSize']
-                tasks.append(fetch_page(session, url, payload, page))
-
-            logging.debug(f"Fetching batch of pages {page_offset} to {page_offset + batch_size - 1}")
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Process batch results
-            batch_has_items = False
-            end_of_list = False
-            for page_num, result in enumerate(results, page_offset):
-                if isinstance(result, list):
-                    if result:
-                        batch_has_items = True
-                        for item in result:
-                            script_id = str(item.get('scriptId', ''))
-                            script_name = item.get('scriptName', '')
-                            if script_id:
-                                all_data.append({
-                                    'scriptId': script_id,
-                                    'scriptName': script_name,
-                                    'firstFetchAt': current_time,
-                                    'lastModifiedAt': current_time,
-                                    'coverImageDownloaded': False,
-                                    'imageContentDownloaded': False,
-                                    'coverImageUploaded': False,
-                                    'imageContentUploaded': False,
-                                    'databaseInserted': False  # New flag
-                                })
-                    else:
-                        logging.info(f"Empty list at pageNum={page_num}, checking if end of pagination")
-                        end_of_list = True
-                elif result is None:
-                    logging.warning(f"Page {page_num} returned None due to error, continuing with batch")
-                else:
-                    logging.error(f"Unexpected result type for pageNum={page_num}: {type(result)}")
-
-            if end_of_list and not batch_has_items:
-                logging.info(f"Confirmed end of pagination at batch starting page {page_offset}")
-                break
-            elif not batch_has_items:
-                logging.info(f"No items in batch starting at page {page_offset}, but no empty list confirmed, continuing")
-            page_offset += batch_size
-
-        logging.info(f"Fetched {len(all_data)} scripts across multiple pages")
+        for page_num in sorted(fetched_pages):
+            result = fetched_pages[page_num]
+            if isinstance(result, list):
+                for item in result:
+                    entry = build_script_entry(item, current_time)
+                    if entry:
+                        all_data.append(entry)
+            elif result is None:
+                logging.warning(f"Page {page_num} returned None due to error, skipping")
+            else:
+                logging.error(f"Unexpected result type for pageNum={page_num}: {type(result)}")
+
+        logging.info(f"Fetched {len(all_data)} scripts across {len(fetched_pages)} pages "
+                     f"(peak concurrency {controller.peak_limit:.1f})")
         return all_data
 
-async def fetch_script_detail(session, url, script_id, index, total):
+async def fetch_script_detail(client, url, script_id, index, total):
     """Fetch details for a single scriptId asynchronously with retries."""
     payload = {'scriptId': script_id}
     random_float = random.uniform(0, 1)
@@ -185,74 +300,177 @@ async def fetch_script_detail(session, url, script_id, index, total):
     headers = HEADERS_TEMPLATE.copy()
     headers.update({"Checksum": checksum, "Nonce": nonce})
 
-    for attempt in range(TIMEOUT_RETRY_LIMIT):
-        try:
-            logging.info(f"Fetching details for scriptId={script_id} [{index}/{total}], attempt {attempt+1}")
-            async with session.post(url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as response:
-                response.raise_for_status()
-                data = await response.json()
-                if data and isinstance(data, dict) and 'data' in data:
-                    current_time = int(time.time())
-                    detail = data['data'].copy()  # Copy all fields from the API response
-                    detail['lastModifiedAt'] = current_time  # Add local timestamp
-                    return detail
-                else:
-                    logging.warning(f"[{index}/{total}] Invalid response for scriptId={script_id}")
-                    return None
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logging.warning(f"Attempt {attempt+1} failed for scriptId={script_id} [{index}/{total}]: {str(e)}")
-            if attempt == TIMEOUT_RETRY_LIMIT - 1:
-                logging.error(f"Failed after {TIMEOUT_RETRY_LIMIT} retries for scriptId={script_id} [{index}/{total}]: {str(e)}")
-                return None
-            await asyncio.sleep(2 ** attempt)
-
-async def fetch_script_details(script_ids):
-    """Fetch details for given script_ids concurrently."""
+    async def handle(response):
+        response.raise_for_status()
+        data = await response.json()
+        if data and isinstance(data, dict) and 'data' in data:
+            current_time = int(time.time())
+            detail = data['data'].copy()  # Copy all fields from the API response
+            detail['contentFingerprint'] = payload_fingerprint(data['data'])
+            detail['lastModifiedAt'] = current_time  # Add local timestamp
+            detail['lastFetchedAt'] = current_time
+            return detail
+        logging.warning(f"[{index}/{total}] Invalid response for scriptId={script_id}")
+        return None
+
+    return await client.call('POST', url, handle, f"details for scriptId={script_id} [{index}/{total}]", json=payload, headers=headers)
+
+async def fetch_script_details(script_ids, client=None, journal_path=config.DETAIL_JOURNAL_PATH):
+    """Fetch details into the journal, skipping IDs already in it; returns the number journaled."""
     url = HOST + PLAT_FORM_SCRIPT_INFO
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            fetch_script_detail(session, url, script_id, i + 1, len(script_ids))
-            for i, script_id in enumerate(script_ids)
-        ]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        details = [result for result in results if result is not None]
-        logging.info(f"Fetched details for {len(details)} out of {len(script_ids)} scripts")
-        return details
-
-async def download_image(session, url, save_path, script_idx, total_scripts, image_idx, total_images_for_script, image_type):
-    """Download a single image asynchronously with retries."""
-    for attempt in range(TIMEOUT_RETRY_LIMIT):
-        try:
-            logging.info(f"Attempt {attempt+1} to download {image_type} {url} [Script {script_idx}/{total_scripts}, Image {image_idx}/{total_images_for_script}]")
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as response:
-                response.raise_for_status()
-                content = await response.read()
-                with open(save_path, 'wb') as file:
-                    file.write(content)
-                compress_image(save_path)
-                logging.info(f"[Script {script_idx}/{total_scripts}, Image {image_idx}/{total_images_for_script}] Downloaded {image_type} {os.path.basename(save_path)}")
-                return True
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logging.warning(f"Attempt {attempt+1} failed for {image_type} {url} [Script {script_idx}/{total_scripts}, Image {image_idx}/{total_images_for_script}]: {str(e)}")
-            if attempt == TIMEOUT_RETRY_LIMIT - 1:
-                logging.error(f"Failed after {TIMEOUT_RETRY_LIMIT} retries for {image_type} {url} [Script {script_idx}/{total_scripts}, Image {image_idx}/{total_images_for_script}]: {str(e)}")
-                return False
-            await asyncio.sleep(2 ** attempt)
-    return False
-
-def compress_image(image_path):
-    """Compress image if it exceeds the threshold."""
-    if os.path.getsize(image_path) > COMPRESSION_THRESHOLD:
+    journaled_ids = data_update.read_journal_ids(journal_path)
+    pending_ids = [script_id for script_id in script_ids if str(script_id) not in journaled_ids]
+    if len(pending_ids) < len(script_ids):
+        logging.info(f"Skipping {len(script_ids) - len(pending_ids)} script details already in {journal_path}")
+    total = len(pending_ids)
+    work = iter(enumerate(pending_ids, 1))
+    fetched_count = 0
+
+    async with http_client.borrow(client) as client:
+        with data_update.open_journal(journal_path) as journal:
+            async def worker():
+                nonlocal fetched_count
+                for index, script_id in work:
+                    detail = await fetch_script_detail(client, url, script_id, index, total)
+                    if detail is not None:
+                        data_update.append_journal(journal, detail)
+                        fetched_count += 1
+
+            await asyncio.gather(*(worker() for _ in range(min(config.DETAIL_FETCH_CONCURRENCY, total))))
+
+    logging.info(f"Fetched details for {fetched_count} out of {total} scripts")
+    return fetched_count
+
+# Image responses meaning the URL will not come back; recorded in the manifest so runs stop retrying it
+IMAGE_GONE_STATUSES = (404, 410)
+
+async def download_image(client, url, save_path, script_idx, total_scripts, image_idx, total_images_for_script, image_type, cached=None):
+    """Stream a single image to disk with retries; returns its file info, or None on failure."""
+    progress = f"[Script {script_idx}/{total_scripts}, Image {image_idx}/{total_images_for_script}]"
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('lastModified'):
+            headers['If-Modified-Since'] = cached['lastModified']
+
+    async def handle(response):
+        if response.status in IMAGE_GONE_STATUSES:
+            logging.warning(f"{progress} {image_type} {url} is gone (HTTP {response.status})")
+            return {'gone': True}
+        response.raise_for_status()
+        if response.status == 304 and cached:
+            logging.info(f"{progress} {image_type} {url} not modified")
+            return dict(cached, notModified=True)
+        temp_path = f"{save_path}.part"
+        digest = hashlib.sha256()
+        size = 0
         try:
-            with Image.open(image_path) as img:
-                img = img.convert("RGB")
-                img.save(image_path, "JPEG", quality=85)
-            logging.info(f"Compressed {image_path}")
-        except Exception as e:
-            logging.error(f"Failed to compress {image_path}: {str(e)}")
-
-async def download_images(scripts):
+            with open(temp_path, 'wb') as file:
+                async for chunk in response.content.iter_chunked(config.DOWNLOAD_CHUNK_SIZE):
+                    await asyncio.to_thread(file.write, chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, save_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        logging.info(f"{progress} Downloaded {image_type} {url}")
+        return {
+            'path': save_path,
+            'size': size,
+            'sha256': digest.hexdigest(),
+            'etag': response.headers.get('ETag', ''),
+            'lastModified': response.headers.get('Last-Modified', ''),
+        }
+
+    return await client.call('GET', url, handle, f"{image_type} {url} {progress}", headers=headers)
+
+# (status key, download flag, URL field, per-script folder, filename image_type)
+IMAGE_KINDS = (
+    ('cover', 'coverImageDownloaded', 'scriptCoverUrl', SCRIPT_COVER_FOLDER, 'cover'),
+    ('content', 'imageContentDownloaded', 'scriptImageContent', SCRIPT_IMAGE_CONTENT_FOLDER, 'image_content'),
+)
+
+# Source hashes per image kind, '@'-joined in URL order; derivatives are located by these hashes
+IMAGE_HASH_FIELDS = {'cover': 'coverImageHashes', 'content': 'contentImageHashes'}
+
+async def fetch_to_store(client, processor, url, cached, script_idx, total_scripts, image_idx, total_images_for_script, image_type):
+    """Download one URL into the image store, compressing only bytes not stored yet."""
+    if cached and not os.path.exists(cached.get('path', '')):
+        cached = None
+    staging_path = os.path.join(config.IMAGE_STORE_FOLDER, 'incoming', hashlib.sha1(url.encode('utf-8')).hexdigest())
+    os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+    result = await download_image(client, url, staging_path, script_idx, total_scripts, image_idx, total_images_for_script, image_type, cached)
+    if result is None or result.get('gone'):
+        return result
+    if result.get('notModified'):
+        stored = dict(result, new=False)
+    else:
+        extension = os.path.splitext(urlsplit(url).path)[1]
+        stored = image_store.add_to_store(result['path'], result['sha256'], extension, result['size'])
+        stored.update(etag=result['etag'], lastModified=result['lastModified'])
+    if stored['new']:
+        stored['size'] = await processor.submit(image_processing.compress_image, stored['path'], stored['size'])
+    missing_widths = image_processing.missing_derivative_widths(stored['sha256'])
+    if missing_widths:
+        results = await asyncio.gather(
+            *(processor.submit(image_processing.render_derivatives, stored['path'], stored['sha256'], width) for width in missing_widths),
+            return_exceptions=True
+        )
+        for width, result in zip(missing_widths, results):
+            if isinstance(result, Exception):
+                logging.error(f"Failed to render {width}px derivatives of {url}: {str(result)}")
+    return stored
+
+def image_targets(script, urls, folder, image_type):
+    """[(url, per-script save path)] for one image kind of a script."""
+    script_id = script.get('scriptId', 'unknown')
+    script_name = script.get('scriptName', 'unknown').replace('/', '_').replace('\\', '_')
+    return [
+        (url, os.path.join(folder, get_image_filename(url, script_id, script_name, img_idx, image_type)))
+        for img_idx, url in enumerate(urls, 1)
+    ]
+
+def rebuild_upload_entries(script, kind):
+    """Pending-upload entries for a script's images downloaded before the upload queue existed."""
+    _, _, url_field, folder, image_type = next(entry for entry in IMAGE_KINDS if entry[0] == kind)
+    urls = [url for url in script.get(url_field, '').split('@') if url]
+    hashes = script.get(IMAGE_HASH_FIELDS[kind], '').split('@')
+    hashes += [''] * (len(urls) - len(hashes))
+    script_id = script.get('scriptId', 'unknown')
+    entries = []
+    for (url, save_path), sha256 in zip(image_targets(script, urls, folder, image_type), hashes):
+        if os.path.exists(save_path):
+            entries.append(upload_queue.build_entry(kind, script_id, url, save_path, sha256))
+            if sha256:
+                entries += upload_queue.build_derivative_entries(kind, script_id, url, sha256)
+    return entries
+
+class ImageDownloadSession:
+    """Client, image processing stage and manifest shared by several download_images calls."""
+
+    def __init__(self, client, processor, manifest):
+        self.client = client
+        self.processor = processor
+        self.manifest = manifest
+        self.fetches = {}  # url -> task storing it
+
+    def fetch(self, url, job):
+        if url not in self.fetches:
+            self.fetches[url] = asyncio.ensure_future(self._fetch(url, job))
+        return self.fetches[url]
+
+    async def _fetch(self, url, job):
+        stored = await fetch_to_store(self.client, self.processor, url, self.manifest.get(url), *job)
+        if isinstance(stored, dict) and stored.get('gone'):
+            self.manifest[url] = {'gone': True}
+        elif isinstance(stored, dict):
+            self.manifest[url] = {key: stored.get(key, '') for key in ('sha256', 'size', 'path', 'etag', 'lastModified')}
+        return stored
+
+async def download_images(scripts, client=None, session=None):
     """Download script cover and image content for each script into respective folders asynchronously."""
     os.makedirs(SCRIPT_COVER_FOLDER, exist_ok=True)
     os.makedirs(SCRIPT_IMAGE_CONTENT_FOLDER, exist_ok=True)
@@ -260,122 +478,104 @@ async def download_images(scripts):
     downloaded_images = 0
     total_size = 0
     downloaded_status = {}  # Track download status per scriptId
-    failed_covers = []  # Track failed cover downloads
-    failed_contents = []  # Track failed content downloads
-
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for script_idx, script in enumerate(scripts, 1):
-            script_id = script.get('scriptId', 'unknown')
-            script_name = script.get('scriptName', 'unknown').replace('/', '_').replace('\\', '_')
-            # Log script details for debugging
-            logging.debug(f"Processing scriptId={script_id}: coverDownloaded={script.get('coverImageDownloaded', 'False')}, contentDownloaded={script.get('imageContentDownloaded', 'False')}, coverUrl={script.get('scriptCoverUrl', 'None')}, contentUrl={script.get('scriptImageContent', 'None')}")
-            
-            # Preserve existing flags if already set
-            downloaded_status[script_id] = {
-                'cover': script.get('coverImageDownloaded', 'False') == 'True',
-                'content': script.get('imageContentDownloaded', 'False') == 'True'
-            }
-
-            # Process script cover images only if not already downloaded
-            if not downloaded_status[script_id]['cover']:
-                cover_urls = script.get('scriptCoverUrl', '').split('@')
-                total_covers_for_script = len(cover_urls) if cover_urls and cover_urls[0] else 0
-                if total_covers_for_script > 0:
-                    logging.debug(f"Adding {total_covers_for_script} cover download tasks for scriptId={script_id}")
-                    for img_idx, url in enumerate(cover_urls, 1):
-                        filename = get_image_filename(url, script_id, script_name, img_idx, "cover")
-                        save_path = os.path.join(SCRIPT_COVER_FOLDER, filename)
-                        tasks.append(download_image(session, url, save_path, script_idx, total_scripts, img_idx, total_covers_for_script, "cover"))
-
-            # Process script image content only if not already downloaded
-            if not downloaded_status[script_id]['content']:
-                content_urls = script.get('scriptImageContent', '').split('@')
-                total_contents_for_script = len(content_urls) if content_urls and content_urls[0] else 0
-                if total_contents_for_script > 0:
-                    logging.debug(f"Adding {total_contents_for_script} content download tasks for scriptId={script_id}")
-                    for img_idx, url in enumerate(content_urls, 1):
-                        filename = get_image_filename(url, script_id, script_name, img_idx, "image_content")
-                        save_path = os.path.join(SCRIPT_IMAGE_CONTENT_FOLDER, filename)
-                        tasks.append(download_image(session, url, save_path, script_idx, total_scripts, img_idx, total_contents_for_script, "content"))
-
-        # Log total tasks created
-        logging.debug(f"Total download tasks created: {len(tasks)}")
-
-        # Execute all download tasks concurrently
-        if tasks:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-        else:
-            results = []
+    failed = {'cover': [], 'content': []}  # Track failed downloads per image kind
+    planned = []  # (script, kind, flag_key, [(url, save_path), ...]) for each image set still to download
+    url_jobs = {}  # url -> progress info of its first occurrence, so shared URLs are fetched once
+
+    for script_idx, script in enumerate(scripts, 1):
+        script_id = script.get('scriptId', 'unknown')
+        # Log script details for debugging
+        logging.debug(f"Processing scriptId={script_id}: coverDownloaded={script.get('coverImageDownloaded', 'False')}, contentDownloaded={script.get('imageContentDownloaded', 'False')}, coverUrl={script.get('scriptCoverUrl', 'None')}, contentUrl={script.get('scriptImageContent', 'None')}")
+
+        # Preserve existing flags if already set
+        downloaded_status[script_id] = {
+            kind: str(script.get(flag_key, 'False')) == 'True' for kind, flag_key, _, _, _ in IMAGE_KINDS
+        }
+
+        for kind, flag_key, url_field, folder, image_type in IMAGE_KINDS:
+            if downloaded_status[script_id][kind]:
+                continue
+            urls = [url for url in script.get(url_field, '').split('@') if url]
+            if not urls:
+                continue
+            logging.debug(f"Adding {len(urls)} {kind} downloads for scriptId={script_id}")
+            targets = image_targets(script, urls, folder, image_type)
+            planned.append((script, kind, flag_key, targets))
+            for img_idx, (url, _) in enumerate(targets, 1):
+                url_jobs.setdefault(url, (script_idx, total_scripts, img_idx, len(targets), kind))
+
+    total_targets = sum(len(targets) for _, _, _, targets in planned)
+    logging.debug(f"{total_targets} images to download from {len(url_jobs)} unique URLs")
+
+    async def fetch_all(session):
+        if not url_jobs:
             logging.warning("No download tasks were created")
+            return []
+        return await asyncio.gather(*(session.fetch(url, job) for url, job in url_jobs.items()), return_exceptions=True)
 
-        # Process results and update status
-        task_index = 0
-        for script_idx, script in enumerate(scripts, 1):
-            script_id = script.get('scriptId', 'unknown')
-            script_name = script.get('scriptName', 'unknown')
-            cover_urls = script.get('scriptCoverUrl', '').split('@')
-            content_urls = script.get('scriptImageContent', '').split('@')
-
-            # Reset status to False unless downloads succeed
-            if not downloaded_status[script_id]['cover']:
-                downloaded_status[script_id]['cover'] = False
-            if not downloaded_status[script_id]['content']:
-                downloaded_status[script_id]['content'] = False
-
-            # Process cover downloads
-            if cover_urls and cover_urls[0] and not downloaded_status[script_id]['cover']:
-                for _ in range(len(cover_urls)):
-                    result = results[task_index]
-                    logging.debug(f"Cover result for scriptId={script_id}, idx={_ + 1}: {result}")
-                    if result is True:
-                        downloaded_status[script_id]['cover'] = True
-                        downloaded_images += 1
-                        total_size += os.path.getsize(os.path.join(SCRIPT_COVER_FOLDER, get_image_filename(cover_urls[_], script_id, script_name, _+1, "cover")))
-                    else:
-                        downloaded_status[script_id]['cover'] = False
-                        failed_covers.append({'scriptId': script_id, 'scriptName': script_name})
-                    task_index += 1
-                script['coverImageDownloaded'] = downloaded_status[script_id]['cover']
-
-            # Process content downloads
-            if content_urls and content_urls[0] and not downloaded_status[script_id]['content']:
-                for _ in range(len(content_urls)):
-                    result = results[task_index]
-                    logging.debug(f"Content result for scriptId={script_id}, idx={_ + 1}: {result}")
-                    if result is True:
-                        downloaded_status[script_id]['content'] = True
-                        downloaded_images += 1
-                        total_size += os.path.getsize(os.path.join(SCRIPT_IMAGE_CONTENT_FOLDER, get_image_filename(content_urls[_], script_id, script_name, _+1, "image_content")))
-                    else:
-                        downloaded_status[script_id]['content'] = False
-                        failed_contents.append({'scriptId': script_id, 'scriptName': script_name})
-                    task_index += 1
-                script['imageContentDownloaded'] = downloaded_status[script_id]['content']
-
-            # lastModifiedAt not updated here; handled in fetch_script_detail
-            # firstFetchAt not touched here; preserved from SCRIPT_LIST_PATH
-
-        # Calculate totals
-        total_covers = sum(len(script.get('scriptCoverUrl', '').split('@')) for script in scripts if script.get('scriptCoverUrl', '') and not downloaded_status[script['scriptId']]['cover'])
-        total_contents = sum(len(script.get('scriptImageContent', '').split('@')) for script in scripts if script.get('scriptImageContent', '') and not downloaded_status[script['scriptId']]['content'])
-        successful_covers = total_covers - len(failed_covers)
-        successful_contents = total_contents - len(failed_contents)
-
-        # Logging summary
-        total_size_mb = total_size / (1024 * 1024)
-        logging.info(f"Download Summary:")
-        logging.info(f"  Total Covers: {total_covers}, Successful: {successful_covers}, Failed: {len(failed_covers)}")
-        if failed_covers:
-            logging.info("  Failed Covers:")
-            for fail in failed_covers:
-                logging.info(f"    scriptId: {fail['scriptId']}, scriptName: {fail['scriptName']}")
-        logging.info(f"  Total Image Contents: {total_contents}, Successful: {successful_contents}, Failed: {len(failed_contents)}")
-        if failed_contents:
-            logging.info("  Failed Image Contents:")
-            for fail in failed_contents:
-                logging.info(f"    scriptId: {fail['scriptId']}, scriptName: {fail['scriptName']}")
-        logging.info(f"Downloaded {downloaded_images} images, total size: {total_size_mb:.2f} MB")
+    if session is not None:
+        results = await fetch_all(session)
+    else:
+        manifest = image_store.load_manifest()
+        async with http_client.borrow(client) as client, image_processing.ImageProcessingStage() as processor:
+            results = await fetch_all(ImageDownloadSession(client, processor, manifest))
+        image_store.save_manifest(manifest)
+    url_results = dict(zip(url_jobs, results))
+    pending_uploads = []  # upload_queue entries for every image linked into a script folder
+
+    # Link stored images under their per-script names and update status
+    for script, kind, flag_key, targets in planned:
+        script_id = script.get('scriptId', 'unknown')
+        all_downloaded = True
+        hashes = []
+        for url, save_path in targets:
+            stored = url_results.get(url)
+            logging.debug(f"{kind} result for scriptId={script_id}, url={url}: {stored}")
+            if isinstance(stored, dict) and not stored.get('gone'):
+                image_store.link_into(stored['path'], save_path)
+                pending_uploads.append(upload_queue.build_entry(kind, script_id, url, save_path, stored['sha256']))
+                pending_uploads += upload_queue.build_derivative_entries(kind, script_id, url, stored['sha256'])
+                downloaded_images += 1
+                total_size += stored['size']
+                hashes.append(stored['sha256'])
+            else:
+                all_downloaded = False
+                hashes.append('')
+                failed[kind].append({'scriptId': script_id, 'scriptName': script.get('scriptName', 'unknown')})
+        downloaded_status[script_id][kind] = all_downloaded
+        script[flag_key] = all_downloaded
+        script[IMAGE_HASH_FIELDS[kind]] = '@'.join(hashes)
+
+    upload_queue.enqueue(pending_uploads)
+
+    stored_results = [result for result in url_results.values() if isinstance(result, dict) and not result.get('gone')]
+    new_objects = [result for result in stored_results if result['new']]
+    not_modified_count = sum(1 for result in stored_results if result.get('notModified'))
+
+    # Calculate totals
+    total_covers = sum(len(targets) for _, kind, _, targets in planned if kind == 'cover')
+    total_contents = sum(len(targets) for _, kind, _, targets in planned if kind == 'content')
+    successful_covers = total_covers - len(failed['cover'])
+    successful_contents = total_contents - len(failed['content'])
+
+    # Logging summary
+    total_size_mb = total_size / (1024 * 1024)
+    logging.info(f"Download Summary:")
+    logging.info(f"  Total Covers: {total_covers}, Successful: {successful_covers}, Failed: {len(failed['cover'])}")
+    if failed['cover']:
+        logging.info("  Failed Covers:")
+        for fail in failed['cover']:
+            logging.info(f"    scriptId: {fail['scriptId']}, scriptName: {fail['scriptName']}")
+    logging.info(f"  Total Image Contents: {total_contents}, Successful: {successful_contents}, Failed: {len(failed['content'])}")
+    if failed['content']:
+        logging.info("  Failed Image Contents:")
+        for fail in failed['content']:
+            logging.info(f"    scriptId: {fail['scriptId']}, scriptName: {fail['scriptName']}")
+    logging.info(f"  Deduplication: {total_targets} images, {len(url_jobs)} unique URLs fetched, "
+                 f"{len(new_objects)} new stored objects "
+                 f"({sum(result['size'] for result in new_objects) / (1024 * 1024):.2f} MB), "
+                 f"{not_modified_count} not modified (304)")
+    logging.info(f"Downloaded {downloaded_images} images, total size: {total_size_mb:.2f} MB")
 
     return downloaded_images, total_size_mb
 
@@ -404,14 +604,15 @@ def get_image_filename(url, script_id, script_name, idx, image_type):
         original_filename, file_extension = os.path.splitext(file_name)
         return f"{script_id}_{script_name}_{idx}_{image_type}_{original_filename}{file_extension}"
 
-# Synchronous wrappers for compatibility
-def run_fetch_script_list():
+# Synchronous wrappers for compatibility; each opens its own client, main.main shares one instead
+def run_fetch_script_list(known_ids=None):
     logging.debug("Calling run_fetch_script_list")
-    return asyncio.run(fetch_script_list())
+    return asyncio.run(fetch_script_list(known_ids))
 
 def run_fetch_script_details(script_ids):
     logging.debug("Calling run_fetch_script_details")
-    return asyncio.run(fetch_script_details(script_ids))
+    asyncio.run(fetch_script_details(script_ids))
+    return list(data_update.iter_journal(config.DETAIL_JOURNAL_PATH))
 
 def run_download_images(scripts):
     logging.debug("Calling run_download_images")